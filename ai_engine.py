@@ -1,92 +1,303 @@
 import os
 import json
-import streamlit as st
-from google import genai
-from google.genai import types
+import threading
+import time
+from collections import OrderedDict
+import answer_match
+import llm_backends
+import metrics
+import scheduler
+import singleflight
 
-# Lazy client initialization to work with Streamlit Cloud secrets
+# Bump whenever a prompt changes so cached questions from the old prompt are dropped
+PROMPT_VERSION = "3"
+
+# Error categories shared by diagnose_gap and the per-option annotations in generate_question.
+# They match the keys used for `prerequisites` in curriculum.json.
+ERROR_TYPES = ("ARITHMETIC", "CONCEPTUAL", "ALGEBRAIC", "SKILL", "GRAPHICAL", "GEOMETRIC")
+
+# Client settings are injected by the host app through configure(); the environment is the fallback.
+# One pooled HTTP client is shared by every thread, so TLS setup is paid once per connection,
+# not once per request.
+_client_config = {
+    "api_key": None,
+    "timeout": float(os.environ.get("LLM_HTTP_TIMEOUT", "60")),
+    "max_connections": int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "32")),
+    "max_keepalive": int(os.environ.get("LLM_HTTP_MAX_KEEPALIVE", "16")),
+    "keepalive_expiry": float(os.environ.get("LLM_HTTP_KEEPALIVE_EXPIRY", "120")),
+}
 _client = None
+_client_lock = threading.Lock()
+
+class ConfigurationError(RuntimeError):
+    """The model client can't be built, e.g. no API key was configured."""
+
+def configure(api_key=None, **settings):
+    """Set client options: api_key, timeout (seconds), max_connections, max_keepalive, keepalive_expiry.
+
+    Call once at startup; calling again replaces the shared client on its next use.
+    """
+    global _client
+    unknown = set(settings) - set(_client_config)
+    if unknown:
+        raise TypeError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+    with _client_lock:
+        if api_key is not None:
+            _client_config["api_key"] = api_key
+        _client_config.update(settings)
+        _client = None
+
+def needs_api_key():
+    """True when the Gemini backend is selected but no API key has been configured."""
+    if _client_config["api_key"] or os.environ.get("GEMINI_API_KEY"):
+        return False
+    return isinstance(get_backend(), llm_backends.GeminiBackend)
+
+def _build_client(config):
+    # Imported on first use: the SDK takes about half a second to load and HOME needs no AI
+    import httpx
+    from google import genai
+    from google.genai import types
+    api_key = config["api_key"] or os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        raise ConfigurationError("GEMINI_API_KEY is not set; pass it to ai_engine.configure() or set the environment variable")
+    limits = httpx.Limits(
+        max_connections=config["max_connections"],
+        max_keepalive_connections=config["max_keepalive"],
+        keepalive_expiry=config["keepalive_expiry"],
+    )
+    return genai.Client(api_key=api_key, http_options=types.HttpOptions(
+        timeout=int(config["timeout"] * 1000),  # milliseconds
+        client_args={"limits": limits},
+        async_client_args={"limits": limits},
+    ))
 
+@metrics.timed("get_client_seconds")
 def get_client():
+    """The shared genai.Client, built on first use. Raises ConfigurationError without an API key."""
     global _client
-    if _client is None:
-        # Try Streamlit secrets first (for Streamlit Cloud), then environment variable (for local)
-        try:
-            api_key = st.secrets["GEMINI_API_KEY"]
-        except (KeyError, FileNotFoundError):
-            api_key = os.environ.get("GEMINI_API_KEY")
-        
-        if not api_key:
-            st.error("⚠️ GEMINI_API_KEY not found! Add it to .streamlit/secrets.toml or set as environment variable.")
-            st.stop()
-        
-        _client = genai.Client(api_key=api_key)
-    return _client
+    client = _client
+    if client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client(dict(_client_config))
+            client = _client
+    return client
 
-def generate_question(standard_id, description, error_context=None):
-    prompt = f"""
-    Create a 7th-grade math word problem for Standard: {standard_id} - {description}.
-    
-    CONTEXT:
-    - Theme: Space Exploration, Video Games, or Sports.
-    - {f"PREVIOUS ERROR: Student failed due to {error_context}. Make this question simpler (scaffolding)." if error_context else "Difficulty: Medium."}
-    
-    FORMATTING RULES:
-    - Use LaTeX for all math expressions (enclose in single dollar signs, e.g., $x^2 + 5$).
-    
-    VERIFICATION STEP (MANDATORY):
-    1. First, solve the problem yourself step-by-step.
-    2. Verify your arithmetic is correct before proceeding.
-    3. The correct numerical answer MUST be one of the 4 options.
-    4. Generate 3 plausible wrong answers based on common student errors.
+# --- PROMPTS ---
+# The fixed instructions go out as a system instruction (cached server-side where the backend
+# supports it) and the output shape as a response schema; only the short request varies per call.
+QUESTION_SYSTEM = """You write 7th-grade math word problems for a given standard.
+
+CONTEXT:
+- Theme: Space Exploration, Video Games, or Sports.
+- Difficulty: Medium, unless the request names a previous error; then make the question simpler (scaffolding).
+
+FORMATTING RULES:
+- Use LaTeX for all math expressions (enclose in single dollar signs, e.g., $x^2 + 5$).
+
+VERIFICATION STEP (MANDATORY):
+1. First, solve the problem yourself step-by-step in solution_steps.
+2. Verify your arithmetic is correct before proceeding.
+3. The correct numerical answer MUST be one of the 4 options.
+4. Generate 3 plausible wrong answers based on common student errors.
+5. Tag each wrong answer with the error category that produces it:
+   'ARITHMETIC' (calculation/sign error), 'CONCEPTUAL' (wrong concept or formula),
+   'ALGEBRAIC' (equation manipulation), 'SKILL' (missed or wrong procedure step),
+   'GRAPHICAL' (graph/coordinate misreading) or 'GEOMETRIC' (shape/area/angle misconception).
+
+CRITICAL: correct_answer MUST be an EXACT, CHARACTER-FOR-CHARACTER copy of one of the options. No variations allowed.
+When asked for several problems, vary the scenario, numbers and question type, and make each one follow every rule on its own."""
+
+DIAGNOSIS_SYSTEM = """You diagnose a student's wrong answer to a math question for their teacher.
+Decide which category best describes the error:
+1. 'ARITHMETIC' - Calculation error, integer/decimal mistake, sign error
+2. 'CONCEPTUAL' - Misunderstanding the core concept, wrong formula, logic error
+3. 'ALGEBRAIC' - Equation manipulation error, variable isolation mistake, slope/intercept confusion
+4. 'SKILL' - Procedural error, missing a step, applying wrong procedure
+5. 'GRAPHICAL' - Misreading or plotting graphs incorrectly, coordinate errors
+6. 'GEOMETRIC' - Shape/angle misconception, area/perimeter confusion, spatial reasoning error
+Keep the explanation brief."""
+
+HINT_SYSTEM = """You are a helpful tutor. Give a concise HINT for the problem the student is stuck on.
+- Do NOT solve it.
+- Do NOT give the answer.
+- Just give the first conceptual step.
+- Use LaTeX for math (e.g., $x^2$)."""
+
+_STRING = {"type": "STRING"}
+
+QUESTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "question_text": _STRING,
+        "solution_steps": _STRING,
+        "correct_answer": _STRING,
+        "options": {"type": "ARRAY", "items": _STRING, "min_items": 4, "max_items": 4},
+        # Wrong options with their misconception; converted back to analysis/error_types maps
+        "distractors": {
+            "type": "ARRAY",
+            "min_items": 3,
+            "max_items": 3,
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "option": _STRING,
+                    "error_type": {"type": "STRING", "enum": list(ERROR_TYPES)},
+                    "why": _STRING,
+                },
+                "required": ["option", "error_type", "why"],
+            },
+        },
+    },
+    "required": ["question_text", "solution_steps", "correct_answer", "options", "distractors"],
+    # Solve before writing the options
+    "property_ordering": ["question_text", "solution_steps", "correct_answer", "options", "distractors"],
+}
+
+QUESTION_BATCH_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"questions": {"type": "ARRAY", "items": QUESTION_SCHEMA}},
+    "required": ["questions"],
+}
+
+DIAGNOSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "error_type": {"type": "STRING", "enum": list(ERROR_TYPES)},
+        "explanation": _STRING,
+    },
+    "required": ["error_type", "explanation"],
+}
+
+SYSTEM_INSTRUCTIONS = {
+    "question": QUESTION_SYSTEM,
+    "question_batch": QUESTION_SYSTEM,
+    "diagnosis": DIAGNOSIS_SYSTEM,
+    "hint": HINT_SYSTEM,
+}
+RESPONSE_SCHEMAS = {
+    "question": QUESTION_SCHEMA,
+    "question_batch": QUESTION_BATCH_SCHEMA,
+    "diagnosis": DIAGNOSIS_SCHEMA,
+}
+
+def _question_request(standard_id, description, error_context):
+    """The per-call part of a question prompt."""
+    request = f"Standard: {standard_id} - {description}"
+    if error_context:
+        request += f"\nPREVIOUS ERROR: Student failed due to {error_context}. Make this question simpler (scaffolding)."
+    return request
+
+def _from_schema(item):
+    """Turn the schema's distractor list into the analysis/error_types maps stored with a question."""
+    distractors = item.pop('distractors', None)
+    if isinstance(distractors, list):
+        rows = [d for d in distractors if isinstance(d, dict) and 'option' in d]
+        item['analysis'] = {d['option']: d.get('why', '') for d in rows}
+        item['error_types'] = {d['option']: d.get('error_type', '') for d in rows}
+    return item
+
+def _repair_answer(result):
+    """Make correct_answer an exact copy of one of the options.
+
+    Returns False when no option resembles correct_answer and the first option had to be assumed.
+    """
+    options = result.get('options', [])
+    correct = result.get('correct_answer', '')
+    if correct in options or not options:
+        metrics.inc("answer_repair_total", outcome="exact")
+        return True
     
-    CRITICAL: The "correct_answer" field MUST be an EXACT, CHARACTER-FOR-CHARACTER copy of one of the strings in the "options" array. No variations allowed.
+    # If correct_answer doesn't exactly match any option, use the option with the same value
+    match = answer_match.find_option(correct, options)
+    if match is not None:
+        result['correct_answer'] = match
+        metrics.inc("answer_repair_total", outcome="equivalent")
+        return True
     
-    OUTPUT JSON FORMAT ONLY:
-    {{
-        "question_text": "The word problem text...",
-        "solution_steps": "Show your step-by-step solution here to verify correctness",
-        "correct_answer": "MUST BE EXACT COPY of one option",
-        "options": ["Option A", "Option B", "Option C", "Option D"],
-        "analysis": {{
-            "Option A": "Why this is wrong (specific misconception)...",
-            "Option B": "Why this is wrong...",
-            "Option C": "Why this is wrong..."
-        }}
-    }}
-    """
+    # Last resort: assume first option is correct (shouldn't happen often)
+    result['correct_answer'] = options[0]
+    metrics.inc("answer_repair_total", outcome="assumed_first_option")
+    return False
+
+def warm_up():
+    """Build the backend (and, for Gemini, the client and its first connection) ahead of the first AI call."""
+    backend = get_backend()
+    if isinstance(backend, llm_backends.GeminiBackend):
+        # A metadata request opens the TLS connection without spending tokens
+        get_client().models.get(model=backend.model_for("question"))
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """The configured model backend (see llm_backends; LLM_BACKEND=fake runs fully offline)."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = llm_backends.backend_from_env(get_client)
+    return _backend
+
+def set_backend(backend):
+    """Swap the backend at runtime, e.g. a FakeBackend for load tests."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+# Scheduling class per call type; prefetch and cache refill lower it with scheduler.priority()
+CALL_PRIORITY = {
+    "question": scheduler.FOREGROUND,
+    "question_batch": scheduler.FOREGROUND,
+    "diagnosis": scheduler.INTERACTIVE,
+    "hint": scheduler.INTERACTIVE,
+}
+
+def _call_model(call_type, prompt, json_mode=False, **params):
+    """Send one request through the shared rate limiter (with retries on 429/5xx)."""
+    level = scheduler.current_priority(CALL_PRIORITY[call_type])
+    schema = RESPONSE_SCHEMAS.get(call_type) if json_mode else None
+    with metrics.timer("llm_request_seconds", call_type=call_type):
+        result = scheduler.get_scheduler().call(
+            lambda: get_backend().generate(call_type, prompt, json_mode=json_mode,
+                                           system_instruction=SYSTEM_INSTRUCTIONS[call_type],
+                                           response_schema=schema, **params),
+            level
+        )
+    # prompt tokens include any served from the context cache; the difference is what we resend
+    metrics.inc("llm_prompt_tokens_total", result.prompt_tokens, call_type=call_type)
+    metrics.inc("llm_cached_prompt_tokens_total", result.cached_tokens, call_type=call_type)
+    metrics.inc("llm_output_tokens_total", result.output_tokens, call_type=call_type)
+    return result
+
+def _generate_json(call_type, prompt, **params):
+    text = _call_model(call_type, prompt, json_mode=True, **params).text
+    with metrics.timer("json_parse_seconds", call_type=call_type):
+        return json.loads(text)
+
+@metrics.timed("ai_engine_seconds", fn="generate_question")
+def generate_question(standard_id, description, error_context=None):
+    prompt = _question_request(standard_id, description, error_context)
     
     try:
-        response = get_client().models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
-            )
-        )
-        result = json.loads(response.text)
+        result = _generate_json("question", prompt, standard_id=standard_id, error_context=error_context)
         # Handle case where API returns a list instead of dict
         if isinstance(result, list) and len(result) > 0:
             result = result[0]
         
         if isinstance(result, dict):
+            _from_schema(result)
             # CRITICAL FIX: Ensure correct_answer exactly matches one of the options
-            options = result.get('options', [])
-            correct = result.get('correct_answer', '')
-            
-            # If correct_answer doesn't exactly match any option, try to find the best match
-            if correct not in options and options:
-                correct_lower = correct.lower().strip()
-                for opt in options:
-                    # Check if the correct answer is contained in the option or vice versa
-                    if correct_lower in opt.lower() or opt.lower() in correct_lower:
-                        result['correct_answer'] = opt
-                        break
-                else:
-                    # Last resort: assume first option is correct (shouldn't happen often)
-                    result['correct_answer'] = options[0]
-            
-            return result
+            if _repair_answer(result):
+                return result
+            # No option matched the model's answer: the key would be a guess, so drop the question
+            # (like generate_questions does) rather than let it be cached and served to everyone
+            return {
+                "question_text": "Error: the answer key matched none of the options.",
+                "options": ["Error"],
+                "correct_answer": "Error",
+                "analysis": {"Error": f"No option equals {result.get('correct_answer')!r}"}
+            }
         else:
             return {
                 "question_text": "Error: Unexpected API response format.",
@@ -95,6 +306,7 @@ def generate_question(standard_id, description, error_context=None):
                 "analysis": {"Error": f"Got {type(result)} instead of dict"}
             }
     except Exception as e:
+        metrics.inc("ai_engine_fallbacks_total", fn="generate_question", error=type(e).__name__)
         return {
             "question_text": "Error generating question. Please check API Key.",
             "options": ["Error"],
@@ -102,62 +314,147 @@ def generate_question(standard_id, description, error_context=None):
             "analysis": {"Error": str(e)}
         }
 
-def diagnose_gap(question_text, wrong_answer, standard_id):
-    prompt = f"""
-    Task: Diagnose the student's error.
-    Standard: {standard_id}
-    Question: {question_text}
-    Student Answer: {wrong_answer}
-    
-    Decide which category best describes the error:
-    1. 'ARITHMETIC' - Calculation error, integer/decimal mistake, sign error
-    2. 'CONCEPTUAL' - Misunderstanding the core concept, wrong formula, logic error
-    3. 'ALGEBRAIC' - Equation manipulation error, variable isolation mistake, slope/intercept confusion
-    4. 'SKILL' - Procedural error, missing a step, applying wrong procedure
-    5. 'GRAPHICAL' - Misreading or plotting graphs incorrectly, coordinate errors
-    6. 'GEOMETRIC' - Shape/angle misconception, area/perimeter confusion, spatial reasoning error
-    
-    OUTPUT JSON ONLY:
-    {{
-        "error_type": "ARITHMETIC" or "CONCEPTUAL" or "ALGEBRAIC" or "SKILL" or "GRAPHICAL" or "GEOMETRIC",
-        "explanation": "Brief explanation for the teacher."
-    }}
+@metrics.timed("ai_engine_seconds", fn="generate_questions")
+def generate_questions(standard_id, description, n, error_context=None, max_rounds=2):
+    """Generate up to n independent, validated questions in as few model calls as possible.
+
+    Each round asks for all still-missing questions in one call. Items that fail validation
+    (including ones whose correct_answer can't be matched to an option) are dropped and only
+    those are requested again; after max_rounds the partial list is returned.
     """
+    questions = []
+    for _ in range(max_rounds):
+        missing = n - len(questions)
+        if missing <= 0:
+            break
+        prompt = f"{_question_request(standard_id, description, error_context)}\nWrite {missing} DIFFERENT problems."
+        try:
+            result = _generate_json("question_batch", prompt, standard_id=standard_id,
+                                    error_context=error_context, n=missing)
+        except Exception as e:
+            metrics.inc("ai_engine_fallbacks_total", fn="generate_questions", error=type(e).__name__)
+            continue
+        items = result.get('questions', []) if isinstance(result, dict) else result
+        if not isinstance(items, list):
+            continue
+        for item in items[:missing]:
+            if isinstance(item, dict) and _repair_answer(_from_schema(item)) and validate_question(item):
+                questions.append(item)
+    return questions
+
+def validate_question(q):
+    """True if q is a well-formed multiple-choice question safe to cache and reuse."""
+    if not isinstance(q, dict) or not q.get('question_text'):
+        return False
+    options = q.get('options')
+    if not isinstance(options, list) or len(options) != 4 or len(set(options)) != 4:
+        return False
+    correct = q.get('correct_answer')
+    if correct not in options or "Error" in options:
+        return False
+    # A distractor with the same value as the answer would be graded correct
+    return not any(answer_match.equivalent(opt, correct) for opt in options if opt != correct)
+
+def diagnosis_from_question(q, wrong_answer):
+    """Diagnose a wrong answer from the annotations stored with the question, without calling the model.
+
+    Returns None when the chosen option has no valid error_type, so the caller can fall back to diagnose_gap.
+    """
+    if not isinstance(q, dict):
+        return None
+    error_types = q.get('error_types')
+    if not isinstance(error_types, dict):
+        return None
+    err_type = str(error_types.get(wrong_answer, '')).strip().upper()
+    if err_type not in ERROR_TYPES:
+        return None
+    explanation = q.get('analysis', {}).get(wrong_answer)
+    if not isinstance(explanation, str) or not explanation:
+        explanation = f"Likely a {err_type.lower()} error."
+    return {"error_type": err_type, "explanation": explanation}
+
+@metrics.timed("ai_engine_seconds", fn="diagnose_gap")
+def diagnose_gap(question_text, wrong_answer, standard_id):
+    prompt = f"Standard: {standard_id}\nQuestion: {question_text}\nStudent Answer: {wrong_answer}"
     
     try:
-        response = get_client().models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
-            )
+        # Identical diagnoses requested at the same moment share one model call
+        result = singleflight.do(
+            ("diagnose_gap", standard_id, question_text, wrong_answer, PROMPT_VERSION),
+            _generate_json, "diagnosis", prompt, standard_id=standard_id,
+            question_text=question_text, wrong_answer=wrong_answer
         )
-        result = json.loads(response.text)
         # Handle case where API returns a list instead of dict
         if isinstance(result, list) and len(result) > 0:
             result = result[0]
         return result if isinstance(result, dict) else {"error_type": "CONCEPTUAL", "explanation": "Unexpected response format."}
     except Exception as e:
+        metrics.inc("ai_engine_fallbacks_total", fn="diagnose_gap", error=type(e).__name__)
         return {"error_type": "CONCEPTUAL", "explanation": "API Error, defaulting to Conceptual."}
 
+HINT_FALLBACK = "Review the properties of operations and try again."
+HINT_CACHE_SIZE = 2000
+
+# Hints are shared across sessions: a cached question is shown to many students
+_hint_cache = OrderedDict()
+_hint_lock = threading.Lock()
+
+def cached_hint(question_text):
+    """Return the hint already generated for this question, or None."""
+    with _hint_lock:
+        hint = _hint_cache.get(question_text)
+        if hint is not None:
+            _hint_cache.move_to_end(question_text)
+        return hint
+
+def _store_hint(question_text, hint):
+    with _hint_lock:
+        _hint_cache[question_text] = hint
+        _hint_cache.move_to_end(question_text)
+        while len(_hint_cache) > HINT_CACHE_SIZE:
+            _hint_cache.popitem(last=False)
+
+def _hint_prompt(question_text):
+    return f'The student is stuck on this problem:\n"{question_text}"'
+
+@metrics.timed("ai_engine_seconds", fn="generate_hint")
 def generate_hint(question_text):
     """Generate a pedagogical hint without revealing the answer."""
-    prompt = f"""
-    You are a helpful tutor. The student is stuck on this problem:
-    "{question_text}"
-    
-    Provide a concise HINT. 
-    - Do NOT solve it.
-    - Do NOT give the answer.
-    - Just give the first conceptual step.
-    - Use LaTeX for math (e.g., $x^2$).
-    """
+    hint = cached_hint(question_text)
+    if hint is not None:
+        return hint
     try:
-        response = get_client().models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
+        hint = singleflight.do(
+            ("generate_hint", question_text, PROMPT_VERSION),
+            lambda: _call_model("hint", _hint_prompt(question_text), question_text=question_text).text
         )
-        return response.text
-    except Exception:
-        return "Review the properties of operations and try again."
+        _store_hint(question_text, hint)
+        return hint
+    except Exception as e:
+        metrics.inc("ai_engine_fallbacks_total", fn="generate_hint", error=type(e).__name__)
+        return HINT_FALLBACK
 
+def generate_hint_stream(question_text):
+    """Like generate_hint, but yields the hint in chunks as the model produces them."""
+    hint = cached_hint(question_text)
+    if hint is not None:
+        yield hint
+        return
+    chunks = []
+    start = time.perf_counter()
+    try:
+        scheduler.get_scheduler().admit(scheduler.current_priority(CALL_PRIORITY["hint"]))
+        for chunk in get_backend().generate_stream("hint", _hint_prompt(question_text),
+                                                   system_instruction=HINT_SYSTEM, question_text=question_text):
+            if not chunks:
+                metrics.observe("hint_first_chunk_seconds", time.perf_counter() - start)
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        metrics.inc("ai_engine_fallbacks_total", fn="generate_hint_stream", error=type(e).__name__)
+        # Only fall back if nothing was shown yet; never cache a partial hint
+        if not chunks:
+            yield HINT_FALLBACK
+        return
+    metrics.observe("ai_engine_seconds", time.perf_counter() - start, fn="generate_hint_stream")
+    _store_hint(question_text, "".join(chunks))
@@ -0,0 +1,279 @@
+"""Incrementally maintained aggregates over the attempt log, for the teacher/ops view.
+
+Attempts are streamed from progress_store (a generator, so the log is never loaded whole)
+and folded into per-standard counters:
+    - attempts and accuracy
+    - error-type histogram from diagnose_gap
+    - most common wrong options (Space-Saving, at most TOP_OPTIONS tracked per standard)
+    - gap routes: how often a (standard, error type) sent students to each prerequisite
+
+Memory is bounded by the curriculum, not by the number of attempts. The aggregates and
+the id of the last attempt folded in are written to ANALYTICS_SNAPSHOT_PATH at most every
+ANALYTICS_SNAPSHOT_INTERVAL seconds, so a restart catches up from there instead of
+rescanning the log.
+
+Usage:
+    python analytics.py                       # catch up from the progress store and print
+    python analytics.py --log attempts.jsonl  # rebuild from an exported JSONL log
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+SNAPSHOT_PATH = os.environ.get("ANALYTICS_SNAPSHOT_PATH", "analytics_snapshot.json")
+SNAPSHOT_INTERVAL = float(os.environ.get("ANALYTICS_SNAPSHOT_INTERVAL", "300"))
+# Readers refresh from the log at most this often
+REFRESH_INTERVAL = float(os.environ.get("ANALYTICS_REFRESH_INTERVAL", "30"))
+TOP_OPTIONS = int(os.environ.get("ANALYTICS_TOP_OPTIONS", "25"))
+SNAPSHOT_VERSION = 1
+
+class TopK:
+    """Space-Saving heavy hitters: tracks at most `capacity` items; counts may overestimate by the evicted minimum."""
+
+    def __init__(self, capacity=TOP_OPTIONS, counts=None):
+        self.capacity = capacity
+        self.counts = dict(counts or {})
+
+    def add(self, item):
+        counts = self.counts
+        if item in counts:
+            counts[item] += 1
+        elif len(counts) < self.capacity:
+            counts[item] = 1
+        else:
+            victim = min(counts, key=counts.get)
+            counts[item] = counts.pop(victim) + 1
+
+    def most_common(self, n=None):
+        ranked = sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        return ranked if n is None else ranked[:n]
+
+class StandardStats:
+    __slots__ = ("attempts", "correct", "error_types", "wrong_options", "routes")
+
+    def __init__(self):
+        self.attempts = 0
+        self.correct = 0
+        self.error_types = {}    # error type -> count
+        self.wrong_options = TopK()
+        self.routes = {}         # (error type, gap standard) -> count
+
+    @property
+    def accuracy(self):
+        return self.correct / self.attempts if self.attempts else None
+
+    def to_dict(self):
+        return {
+            "attempts": self.attempts,
+            "correct": self.correct,
+            "error_types": self.error_types,
+            "wrong_options": self.wrong_options.most_common(),
+            "routes": [[err, gap, n] for (err, gap), n in sorted(self.routes.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.attempts = data["attempts"]
+        stats.correct = data["correct"]
+        stats.error_types = dict(data["error_types"])
+        stats.wrong_options = TopK(counts=dict(data["wrong_options"]))
+        stats.routes = {(err, gap): n for err, gap, n in data["routes"]}
+        return stats
+
+class Aggregates:
+    """Per-standard StandardStats plus the id of the last attempt folded in."""
+
+    def __init__(self):
+        self.standards = {}
+        self.last_id = 0
+
+    def add(self, attempt):
+        std = attempt["standard_id"]
+        stats = self.standards.get(std)
+        if stats is None:
+            stats = self.standards[std] = StandardStats()
+        stats.attempts += 1
+        if attempt["is_correct"]:
+            stats.correct += 1
+        else:
+            err = attempt.get("error_type") or "UNKNOWN"
+            stats.error_types[err] = stats.error_types.get(err, 0) + 1
+            if attempt.get("answer"):
+                stats.wrong_options.add(str(attempt["answer"]).strip())
+            if attempt.get("gap_id"):
+                route = (err, attempt["gap_id"])
+                stats.routes[route] = stats.routes.get(route, 0) + 1
+        self.last_id = max(self.last_id, attempt.get("id") or 0)
+
+    def to_dict(self):
+        return {"version": SNAPSHOT_VERSION, "last_id": self.last_id,
+                "standards": {std: s.to_dict() for std, s in sorted(self.standards.items())}}
+
+    @classmethod
+    def from_dict(cls, data):
+        agg = cls()
+        if data.get("version") != SNAPSHOT_VERSION:
+            return agg
+        agg.last_id = data["last_id"]
+        agg.standards = {std: StandardStats.from_dict(s) for std, s in data["standards"].items()}
+        return agg
+
+    # --- VIEWS ---
+    def standard_rows(self):
+        """One row per standard, weakest accuracy first."""
+        rows = []
+        for std, s in self.standards.items():
+            top_error = max(s.error_types.items(), key=lambda kv: kv[1])[0] if s.error_types else None
+            top_wrong = s.wrong_options.most_common(1)
+            rows.append({
+                "standard_id": std,
+                "attempts": s.attempts,
+                "correct": s.correct,
+                "accuracy": round(s.accuracy, 3),
+                "top_error_type": top_error,
+                "top_wrong_option": top_wrong[0][0] if top_wrong else None,
+            })
+        return sorted(rows, key=lambda r: (r["accuracy"], -r["attempts"]))
+
+    def error_histogram(self):
+        totals = {}
+        for s in self.standards.values():
+            for err, n in s.error_types.items():
+                totals[err] = totals.get(err, 0) + n
+        return dict(sorted(totals.items(), key=lambda kv: -kv[1]))
+
+    def wrong_options(self, standard_id, n=5):
+        s = self.standards.get(standard_id)
+        return s.wrong_options.most_common(n) if s else []
+
+    def route_rows(self, n=20):
+        rows = [{"from": std, "error_type": err, "gap": gap, "count": count}
+                for std, s in self.standards.items() for (err, gap), count in s.routes.items()]
+        return sorted(rows, key=lambda r: -r["count"])[:n]
+
+    def route_errors(self, gap_id):
+        """Error types that have routed students to gap_id."""
+        return {err for s in self.standards.values() for (err, gap) in s.routes if gap == gap_id}
+
+    def prewarm_targets(self, n=10):
+        """Standards most likely to be requested next: where students practise plus where gap routes send them."""
+        demand = {}
+        for std, s in self.standards.items():
+            demand[std] = demand.get(std, 0) + s.attempts
+            for (_, gap), count in s.routes.items():
+                demand[gap] = demand.get(gap, 0) + count
+        return sorted(demand.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+def read_log(path):
+    """Yield attempts from a JSONL export one line at a time."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+class AttemptAnalytics:
+    """Keeps Aggregates current by tailing the store's attempt log; thread-safe."""
+
+    def __init__(self, store, snapshot_path=SNAPSHOT_PATH, snapshot_interval=SNAPSHOT_INTERVAL,
+                 refresh_interval=REFRESH_INTERVAL):
+        self.store = store
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._refreshed_at = float("-inf")
+        self._snapshot_at = time.monotonic()
+        self.aggregates = self._load_snapshot()
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path) as f:
+                return Aggregates.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return Aggregates()
+
+    def snapshot(self):
+        """Write the aggregates atomically; only counters are kept, never raw attempts."""
+        tmp = f"{self.snapshot_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.aggregates.to_dict(), f)
+        os.replace(tmp, self.snapshot_path)
+        self._snapshot_at = time.monotonic()
+
+    def refresh(self, force=False):
+        """Fold in attempts logged since the last refresh and return a copy of the aggregates."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._refreshed_at < self.refresh_interval:
+                return Aggregates.from_dict(self.aggregates.to_dict())
+            start = time.perf_counter()
+            folded = 0
+            for attempt in self.store.attempts(since_id=self.aggregates.last_id):
+                self.aggregates.add(attempt)
+                folded += 1
+            self._refreshed_at = now
+            metrics.inc("analytics_attempts_folded_total", folded)
+            metrics.observe("analytics_refresh_seconds", time.perf_counter() - start)
+            if folded and (force or now - self._snapshot_at >= self.snapshot_interval):
+                self.snapshot()
+            # A copy, so readers never iterate counters another thread is updating
+            return Aggregates.from_dict(self.aggregates.to_dict())
+
+def prewarm(aggregates, curriculum, n=10):
+    """Top up the question pools students are most likely to hit next; returns the (standard, error type) pools.
+
+    Practised standards get their normal pool; gap routes land in the scaffold pool for
+    the routed error type, since "Fix" asks for scaffolded questions.
+    """
+    import question_cache
+    cache = question_cache.get_cache()
+    pools = []
+    for std, _ in aggregates.prewarm_targets(n):
+        if std not in curriculum:
+            continue
+        if std in aggregates.standards:
+            pools.append((std, None))
+        pools.extend((std, err) for err in sorted(aggregates.route_errors(std)))
+    for std, err in pools:
+        cache.prewarm(std, curriculum[std]['description'], err)
+    return pools
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+def get_analytics():
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None:
+            import progress_store
+            _analytics = AttemptAnalytics(progress_store.get_store())
+    return _analytics
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate the attempt log into per-standard analytics.")
+    parser.add_argument("--log", help="rebuild from this JSONL attempt export instead of the progress store")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.log:
+        agg = Aggregates()
+        for attempt in read_log(args.log):
+            agg.add(attempt)
+    else:
+        agg = get_analytics().refresh(force=True)
+    print(json.dumps({
+        "standards": agg.standard_rows()[:args.top],
+        "error_types": agg.error_histogram(),
+        "routes": agg.route_rows(args.top),
+        "prewarm": agg.prewarm_targets(args.top),
+    }, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
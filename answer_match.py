@@ -0,0 +1,376 @@
+"""Exact answer equivalence for grading and for repairing model output.
+
+canonical() parses a LaTeX or plain-text answer into an exact, hashable form:
+    - numbers (integers, decimals, fractions, mixed numbers, percents) become Fractions
+    - polynomial expressions like 2x+3 become sorted (monomial, coefficient) terms
+    - equations and inequalities are moved to one side and scaled to a fixed leading term
+    - anything else falls back to a whitespace/case-normalized string
+    - a trailing unit ("12 hours", "5cm", "12 cm^2", "-5°C", "60 km/h") is normalized and
+      kept: ("unit", unit, form)
+Results are memoized, so regrading the same option strings costs one dict lookup.
+"""
+import re
+from fractions import Fraction
+from functools import lru_cache
+
+# Multi-character LaTeX and unicode replacements, applied in order
+_REPLACEMENTS = (
+    ("\\$", ""), ("$", ""), ("\\left", ""), ("\\right", ""), ("\\displaystyle", ""),
+    ("\\(", ""), ("\\)", ""), ("\\!", ""), ("\\,", " "), ("\\;", " "), ("\\ ", " "),
+    ("−", "-"), ("–", "-"), ("\\%", "%"),
+    ("\\cdot", "*"), ("\\times", "*"), ("×", "*"), ("·", "*"), ("\\div", "/"), ("÷", "/"),
+    ("\\leq", "<="), ("\\geq", ">="), ("\\le", "<="), ("\\ge", ">="), ("≤", "<="), ("≥", ">="),
+    ("\\lt", "<"), ("\\gt", ">"), ("\\neq", "!="), ("≠", "!="), ("\\pi", "π"),
+    ("²", "^2"), ("³", "^3"),
+)
+# A trailing degree sign is a unit ("-5°C", "40^\circ"); one anywhere else is dropped
+_DEGREES = re.compile(r"\s*(?:\^\s*\{?\s*\\circ\s*\}?|°)\s*([CF](?![A-Za-z]))?\s*$")
+_DEGREE_MARK = re.compile(r"\^\s*\{?\s*\\circ\s*\}?|°")
+_TEXT = re.compile(r"\\(?:text|mathrm|textbf|mbox)\s*\{([^{}]*)\}")
+_MIXED_LATEX = re.compile(r"(\d+)\s*\\[dt]?frac\{(\d+)\}\{(\d+)\}")
+_FRAC = re.compile(r"\\[dt]?frac\{([^{}]*)\}\{([^{}]*)\}")
+_MIXED_PLAIN = re.compile(r"(?<![\d.])(\d+)\s+(\d+)\s*/\s*(\d+)")
+_GROUPED_NUMBER = re.compile(r"-?\d{1,3}(?:,\d{3})+(?:\.\d+)?")
+_PERCENT = re.compile(r"(\d+(?:\.\d*)?|\.\d+)\s*%")
+# Trailing unit words ("12 hours", "5 cm", "12 m", "5cm", "3 cm^2", "60 km/h"); short letter runs
+# like 2xy and 5m are left alone as variables
+_UNIT_POWER = r"(?:\s*\^\s*\(?\s*[23]\s*\)?)?"
+_UNITS = re.compile(
+    r"(?<=[\d)π])(?:\s*[A-Za-z]{3,}|\s+[A-Za-z]{2}|\s+[mgL]|(?<=\d)(?:[cmk]m|kg|mg|m[lL]|ft|yd|lbs?|oz|hrs?))"
+    r"\.?" + _UNIT_POWER + r"(?:\s*/\s*[A-Za-z]+\.?" + _UNIT_POWER + r")?(?:\s+[A-Za-z]+\.?)*\s*$"
+)
+_UNIT_POWER_SUFFIX = re.compile(r"\^\s*\(?\s*([23])\s*\)?")
+_UNIT_ALIASES = {
+    "s": "second", "sec": "second", "secs": "second", "min": "minute", "mins": "minute",
+    "h": "hour", "hr": "hour", "hrs": "hour", "ft": "foot", "feet": "foot", "in": "inch", "inches": "inch",
+    "yd": "yard", "mi": "mile", "mm": "millimeter", "cm": "centimeter", "m": "meter", "km": "kilometer",
+    "metre": "meter", "metres": "meter", "g": "gram", "kg": "kilogram", "lb": "pound", "lbs": "pound",
+    "oz": "ounce", "l": "liter", "ml": "milliliter", "litre": "liter", "sq": "square", "cu": "cubic",
+    "mg": "milligram", "deg": "degree", "celsius": "c", "fahrenheit": "f", "mph": "mile per hour",
+}
+_RELATION = re.compile(r"(<=|>=|!=|=|<|>)")
+_TOKEN = re.compile(r"\s*(?:(\d+\.?\d*|\.\d+)|([A-Za-zπ])|([-+*/^()]))")
+_SPACE = re.compile(r"\s+")
+# Words ("Yes", "none") are compared as text rather than multiplied out as variables
+_WORD = re.compile(r"[A-Za-z]{3,}")
+_FRAC_SHORT = re.compile(r"\\[dt]?frac\s*(\d)\s*(\d)")
+
+# Guard against answers like 10^{100000} blowing up the exact arithmetic
+_MAX_EXPONENT = 64
+_MAX_BITS = 4096
+
+class _ParseError(ValueError):
+    pass
+
+# --- POLYNOMIALS ---
+# A polynomial is {monomial: Fraction}; a monomial is a sorted tuple of (variable, power)
+
+def _const(value):
+    return {(): Fraction(value)} if value else {}
+
+def _add(p, q, sign=1):
+    out = dict(p)
+    for mono, c in q.items():
+        total = out.get(mono, 0) + sign * c
+        if total:
+            out[mono] = total
+        else:
+            out.pop(mono, None)
+    return out
+
+def _mul(p, q):
+    out = {}
+    for m1, c1 in p.items():
+        for m2, c2 in q.items():
+            powers = dict(m1)
+            for var, e in m2:
+                powers[var] = powers.get(var, 0) + e
+            mono = tuple(sorted((v, e) for v, e in powers.items() if e))
+            total = out.get(mono, 0) + c1 * c2
+            if total:
+                out[mono] = total
+            else:
+                out.pop(mono, None)
+    return out
+
+def _constant_value(p):
+    if not p:
+        return Fraction(0)
+    if set(p) == {()}:
+        return p[()]
+    return None
+
+def _power(base, exponent):
+    e = _constant_value(exponent)
+    if e is None or e.denominator != 1 or abs(e) > _MAX_EXPONENT:
+        raise _ParseError("unsupported exponent")
+    e = int(e)
+    value = _constant_value(base)
+    if value is not None:
+        if value == 0 and e < 0:
+            raise _ParseError("division by zero")
+        bits = max(value.numerator.bit_length(), value.denominator.bit_length())
+        if bits * abs(e) > _MAX_BITS:
+            raise _ParseError("number too large")
+        return _const(value ** e)
+    if e < 0:
+        raise _ParseError("negative power of a variable")
+    out = _const(1)
+    for _ in range(e):
+        out = _mul(out, base)
+    return out
+
+class _Parser:
+    """Recursive descent over + - * / ^, parentheses and implicit multiplication."""
+
+    def __init__(self, text):
+        self.tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if m is None or m.end() == pos:
+                raise _ParseError(f"unexpected character at {pos}")
+            self.tokens.append(m.groups())
+            pos = m.end()
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None, None)
+
+    def take_op(self, *ops):
+        op = self.peek()[2]
+        if op in ops:
+            self.i += 1
+            return op
+        return None
+
+    def parse(self):
+        if not self.tokens:
+            raise _ParseError("empty")
+        value = self.expr()
+        if self.i != len(self.tokens):
+            raise _ParseError("trailing input")
+        return value
+
+    def expr(self):
+        value = self.term()
+        while True:
+            op = self.take_op("+", "-")
+            if op is None:
+                return value
+            value = _add(value, self.term(), 1 if op == "+" else -1)
+
+    def term(self):
+        value = self.factor()
+        while True:
+            op = self.take_op("*", "/")
+            if op is None:
+                number, var, paren = self.peek()
+                if number is None and var is None and paren != "(":
+                    return value
+                op = "*"  # implicit multiplication: 2x, 3(x+1), (x+1)(x-1)
+            rhs = self.factor()
+            if op == "*":
+                value = _mul(value, rhs)
+            else:
+                divisor = _constant_value(rhs)
+                if not divisor:
+                    raise _ParseError("division by zero or by a variable")
+                value = {m: c / divisor for m, c in value.items()}
+
+    def factor(self):
+        op = self.take_op("-", "+")
+        if op is not None:
+            value = self.factor()
+            return {m: -c for m, c in value.items()} if op == "-" else value
+        base = self.atom()
+        if self.take_op("^"):
+            return _power(base, self.factor())
+        return base
+
+    def atom(self):
+        number, var, op = self.peek()
+        self.i += 1
+        if number is not None:
+            return _const(Fraction(number))
+        if var is not None:
+            return {((var, 1),): Fraction(1)}
+        if op == "(":
+            value = self.expr()
+            if not self.take_op(")"):
+                raise _ParseError("unbalanced parentheses")
+            return value
+        raise _ParseError("expected a number, variable or '('")
+
+def _freeze(p):
+    return tuple(sorted(p.items()))
+
+def _scale_to_leading(p, keep_sign=False):
+    """Divide by the leading coefficient (its absolute value when keep_sign), so 2y=4x+6 ~ y=2x+3."""
+    if not p:
+        return p
+    lead = p[min(p)]
+    if keep_sign:
+        lead = abs(lead)
+    return {m: c / lead for m, c in p.items()}
+
+# --- NORMALIZATION ---
+def _preprocess(text):
+    for old, new in _REPLACEMENTS:
+        text = text.replace(old, new)
+    text = _TEXT.sub(r" \1 ", text)
+    text = _DEGREE_MARK.sub("", _DEGREES.sub(r" degree \1", text))
+    text = _FRAC_SHORT.sub(r"\\frac{\1}{\2}", text)
+    text = _MIXED_LATEX.sub(r"(\1+\2/\3)", text)
+    previous = None
+    while previous != text:
+        previous = text
+        text = _FRAC.sub(r"((\1)/(\2))", text)
+    text = text.replace("{", "(").replace("}", ")").replace("[", "(").replace("]", ")")
+    text = _MIXED_PLAIN.sub(r"(\1+\2/\3)", text)
+    text = _PERCENT.sub(r"(\1/100)", text)
+    # "d/s; 12 hours": the part after the last semicolon is the answer
+    text = text.rsplit(";", 1)[-1]
+    unit = None
+    m = _UNITS.search(text)
+    if m:
+        text, unit = text[:m.start()], _normalize_unit(m.group(0))
+    text = text.strip()
+    # 1,000 is a number, but (2,300) is a point
+    if _GROUPED_NUMBER.fullmatch(text):
+        text = text.replace(",", "")
+    return text, unit
+
+def _normalize_unit(text):
+    """Lowercase, expand abbreviations and drop plurals: "Sq. Ft", "ft^2" and "square feet" all
+    become "square foot", and "km/h" becomes "kilometer per hour"."""
+    return " per ".join(_normalize_unit_words(part) for part in text.split("/"))
+
+def _normalize_unit_words(text):
+    words = []
+    m = _UNIT_POWER_SUFFIX.search(text)
+    if m:
+        words.append("square" if m.group(1) == "2" else "cubic")
+        text = text[:m.start()] + text[m.end():]
+    for word in text.lower().replace(".", " ").split():
+        if word in _UNIT_ALIASES:
+            word = _UNIT_ALIASES[word]
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-2] if word.endswith(("ches", "shes", "sses", "xes")) else word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+def _split_top_level(text, sep=","):
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+def _canonical_math(text):
+    if _WORD.search(text):
+        raise _ParseError("contains words")
+    pieces = _RELATION.split(text)
+    if len(pieces) == 1:
+        parts = _split_top_level(text)
+        if len(parts) > 1:
+            return ("tuple", tuple(_canonical_math(part) for part in parts))
+        stripped = text.strip()
+        if stripped.startswith("(") and stripped.endswith(")"):
+            inner = _split_top_level(stripped[1:-1])
+            if len(inner) > 1:
+                return ("tuple", tuple(_canonical_math(part) for part in inner))
+        p = _Parser(text).parse()
+        value = _constant_value(p)
+        return ("num", value) if value is not None else ("expr", _freeze(p))
+    if len(pieces) != 3:
+        raise _ParseError("chained relations are compared as text")
+    lhs, op, rhs = pieces
+    p = _add(_Parser(lhs).parse(), _Parser(rhs).parse(), -1)
+    if op in ("=", "!="):
+        return ("eq" if op == "=" else "ne", _freeze(_scale_to_leading(p)))
+    if op in (">", ">="):
+        p = {m: -c for m, c in p.items()}
+        op = "<" if op == ">" else "<="
+    return (op, _freeze(_scale_to_leading(p, keep_sign=True)))
+
+@lru_cache(maxsize=8192)
+def canonical(answer):
+    """Exact hashable form of an answer string; equal forms mean mathematically equal answers."""
+    text, unit = _preprocess(str(answer))
+    try:
+        form = _canonical_math(text)
+    except (_ParseError, ZeroDivisionError, ValueError, RecursionError):
+        # RecursionError: absurdly deep nesting like ((((...)))) is compared as text
+        form = ("text", _SPACE.sub("", text).lower())
+    return ("unit", unit, form) if unit else form
+
+def _solution_value(form):
+    """The number in a solved equation like x = 3, so it can match a bare 3."""
+    if form[0] != "eq" or len(form[1]) != 2:
+        return None
+    (const_mono, const), (var_mono, coeff) = form[1]
+    if const_mono != () or len(var_mono) != 1 or var_mono[0][1] != 1:
+        return None
+    return -const / coeff
+
+def _without_unit(form):
+    return (form[2], form[1]) if form[0] == "unit" else (form, None)
+
+def equivalent(student_answer, correct_answer):
+    """True when the two answers are the same value, expression, equation or inequality.
+
+    Units must match when both answers have one ("3 hours" is not "3 minutes"); an answer
+    without a unit matches on its value alone.
+    """
+    if student_answer == correct_answer:
+        return True
+    (a, unit_a), (b, unit_b) = _without_unit(canonical(student_answer)), _without_unit(canonical(correct_answer))
+    if unit_a and unit_b and unit_a != unit_b:
+        return False
+    return _same_value(a, b)
+
+def _same_value(a, b):
+    if a == b:
+        return True
+    if a[0] == "num" and b[0] == "eq":
+        return _solution_value(b) == a[1]
+    if b[0] == "num" and a[0] == "eq":
+        return _solution_value(a) == b[1]
+    return False
+
+def find_option(answer, options):
+    """The option equivalent to answer, or None."""
+    for opt in options:
+        if equivalent(opt, answer):
+            return opt
+    # Units written two ways ("12 cm^2" vs "12 square units"): fall back to the value when only one option has it
+    value = _without_unit(canonical(answer))[0]
+    matches = [opt for opt in options if _same_value(_without_unit(canonical(opt))[0], value)]
+    return matches[0] if len(matches) == 1 else None
+
+def regrade(attempts, answer_field="answer", correct_field="correct_answer"):
+    """Regrade many attempts at once: each distinct string is parsed once, then grading is lookups.
+
+    attempts is an iterable of dicts (e.g. lines of the attempts log); returns a list of bools.
+    """
+    attempts = list(attempts)
+    forms = {}
+    for attempt in attempts:
+        for field in (answer_field, correct_field):
+            text = str(attempt.get(field, ""))
+            if text not in forms:
+                forms[text] = canonical(text)
+    results = []
+    for attempt in attempts:
+        student, correct = str(attempt.get(answer_field, "")), str(attempt.get(correct_field, ""))
+        a, b = forms[student], forms[correct]
+        results.append(a == b or equivalent(student, correct))
+    return results
@@ -1,6 +1,18 @@
+import functools
+import hmac
+import os
 import streamlit as st
-import json
+import uuid
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import ai_engine
+import analytics
+import answer_match
+import curriculum_index
+import metrics
+import prefetch
+import progress_store
+import question_cache
+import warmup
 
 # --- PAGE CONFIG ---
 st.set_page_config(page_title="Khan MS Math Navigator", page_icon="🗺️", layout="wide")
@@ -63,21 +75,103 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- LOAD CURRICULUM ---
-@st.cache_data
-def load_curriculum():
-    with open('curriculum.json', 'r') as f:
-        return json.load(f)
+# --- MODEL CLIENT ---
+def read_secret(name):
+    """Streamlit secrets first (for Streamlit Cloud), then the environment (for local runs)."""
+    try:
+        return st.secrets[name]
+    except (KeyError, FileNotFoundError):
+        return os.environ.get(name)
+
+@st.cache_resource(show_spinner=False)
+def configure_model_client():
+    """Once per server process: hand the API key to ai_engine."""
+    ai_engine.configure(api_key=read_secret("GEMINI_API_KEY"))
+    return True
+
+configure_model_client()
+
+# --- WARM-UP ---
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    """Once per server process: load the index, caches and model client in the background."""
+    return warmup.start()
 
-data = load_curriculum()
-curriculum = data['nodes']
-strands = data['strands']
+if warmup.ENABLED:
+    start_warmup()
+
+# --- LOAD CURRICULUM ---
+# Indexed once per process: prerequisites, unlocks and strand ladders are all O(1) lookups
+index = curriculum_index.load_index()
+curriculum = index.nodes
+strands = index.strands
 
 # --- SESSION STATE ---
+progress = progress_store.get_store()
+
+if 'student_id' not in st.session_state:
+    # The id lives in the URL, so a reconnect (on any replica) resumes the same progress
+    sid = st.query_params.get("sid", "")
+    st.session_state.student_id = sid if sid.isalnum() and len(sid) <= 64 else uuid.uuid4().hex
+    st.query_params["sid"] = st.session_state.student_id
+    saved = progress.load(st.session_state.student_id)
+    st.session_state.streaks = saved['streaks']
+    st.session_state.mastered_ids = saved['mastered']
+    if saved['current_std'] in curriculum:
+        st.session_state.current_std = saved['current_std']
+        st.session_state.student_q = saved['current_q']
+        st.session_state.page = "PRACTICE"
+
+# Teachers open the app with ?teacher=<TEACHER_KEY> to get the Class Insights view; students never see it
+if 'teacher_mode' not in st.session_state:
+    teacher_key = read_secret("TEACHER_KEY")
+    st.session_state.teacher_mode = bool(teacher_key) and hmac.compare_digest(
+        st.query_params.get("teacher", ""), str(teacher_key))
+teacher_mode = st.session_state.teacher_mode
+
 if 'current_std' not in st.session_state: st.session_state.current_std = "8.F.B.4" 
 if 'student_q' not in st.session_state: st.session_state.student_q = None
 if 'page' not in st.session_state: st.session_state.page = "HOME"
 if 'mastered_ids' not in st.session_state: st.session_state.mastered_ids = set()
+if 'prefetcher' not in st.session_state: st.session_state.prefetcher = prefetch.Prefetcher(st.session_state.student_id)
+
+# Rerun cost: full script runs and per-fragment runs per session (read by loadtest.py)
+st.session_state.script_runs = st.session_state.get('script_runs', 0) + 1
+if 'fragment_runs' not in st.session_state: st.session_state.fragment_runs = {}
+metrics.begin_run("script", session=st.session_state.student_id,
+                  std=st.session_state.current_std, page=st.session_state.page)
+
+def fragment_only_run():
+    """True while Streamlit is rerunning just one or more fragments, not the whole script."""
+    ctx = get_script_run_ctx()
+    return bool(ctx and ctx.fragment_ids_this_run)
+
+def rerun(scope="app"):
+    """st.rerun(), closing this run's metrics trace first.
+
+    scope="fragment" reruns only the calling fragment; during a full run it falls back to "app".
+    """
+    metrics.end_run("rerun")
+    if scope == "fragment" and fragment_only_run():
+        st.rerun(scope="fragment")
+    st.rerun()
+
+def fragment(fn):
+    """st.fragment that counts its runs and traces fragment-only reruns like script runs."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def body(*args, **kwargs):
+        runs = st.session_state.fragment_runs
+        runs[name] = runs.get(name, 0) + 1
+        traced = fragment_only_run() and not metrics.in_run()
+        if traced:
+            metrics.begin_run("fragment", fragment=name, session=st.session_state.student_id,
+                              std=st.session_state.current_std)
+        fn(*args, **kwargs)
+        if traced:
+            metrics.end_run()
+    return st.fragment(body)
 
 # THE FIX: Use a dictionary to track streaks for EACH standard separately
 if 'streaks' not in st.session_state: st.session_state.streaks = {} 
@@ -92,41 +186,27 @@ def update_streak(std_id, is_correct):
         st.session_state.streaks[std_id] = current + 1
     else:
         st.session_state.streaks[std_id] = 0
+    progress.set_streak(st.session_state.student_id, std_id, st.session_state.streaks[std_id])
+
+def ladder_icon(std_id):
+    """Badge shown next to a standard in the sidebar ladder."""
+    if std_id in st.session_state.mastered_ids:
+        return "✅"
+    local_streak = get_streak(std_id)
+    return f"🔥{local_streak}" if local_streak > 0 else "⚪"
 
-# Robust answer matching function
 def answer_matches(student_answer, correct_answer):
-    """Check if student answer matches correct answer with flexible matching."""
-    # Exact match first
-    if student_answer == correct_answer:
-        return True
-    
-    # Normalize: lowercase, strip whitespace
-    s_norm = student_answer.lower().strip()
-    c_norm = correct_answer.lower().strip()
-    
-    if s_norm == c_norm:
-        return True
-    
-    # Check if correct answer is contained in student answer (e.g., "12" in "d/s; 12 hours")
-    if c_norm in s_norm or s_norm in c_norm:
-        return True
-    
-    # Extract just the numeric part if present (e.g., "111" from "5g + 3r; 111")
-    import re
-    s_nums = re.findall(r'-?\d+\.?\d*', student_answer)
-    c_nums = re.findall(r'-?\d+\.?\d*', correct_answer)
-    
-    if s_nums and c_nums:
-        # Compare the last number in each (usually the final answer)
-        if s_nums[-1] == c_nums[-1]:
-            return True
-    
-    return False
+    """Check if student answer is mathematically the same as the correct answer."""
+    return answer_match.equivalent(student_answer, correct_answer)
 
 # --- SIDEBAR: THE CURRICULUM BROWSER ---
 if st.sidebar.button("🏠 Home"):
     st.session_state.page = "HOME"
-    st.rerun()
+    rerun()
+
+if teacher_mode and st.sidebar.button("📊 Class Insights"):
+    st.session_state.page = "INSIGHTS"
+    rerun()
 
 st.sidebar.header("📚 MS Math Curriculum")
 
@@ -142,24 +222,14 @@ st.sidebar.info(f"**Focus:** {selected_strand['description']}")
 st.sidebar.markdown("---")
 
 # 2. The Standard Ladder (Sorted by Grade 8 -> 6)
-strand_nodes = [curriculum[sid] for sid in selected_strand['standards'] if sid in curriculum]
-strand_nodes.sort(key=lambda x: x['grade'], reverse=True)
+strand_nodes = [curriculum[sid] for sid in index.ladder(selected_strand_key)]
 
 st.sidebar.subheader("📍 Progression Path")
 for node in strand_nodes:
-    # Check mastery and streak
-    is_mastered = node['id'] in st.session_state.mastered_ids
-    local_streak = get_streak(node['id'])
-    
-    # Icon Logic
-    icon = "⚪"
-    if is_mastered: icon = "✅"
-    elif local_streak > 0: icon = f"🔥{local_streak}"
+    label = f"{ladder_icon(node['id'])} {node['id']} (Gr {node['grade']})"
     
-    label = f"{icon} {node['id']} (Gr {node['grade']})"
-    
-    # Only highlight current standard if NOT on Home screen
-    if node['id'] == st.session_state.current_std and st.session_state.page != "HOME":
+    # Only highlight current standard while practising
+    if node['id'] == st.session_state.current_std and st.session_state.page == "PRACTICE":
         # Feature #2: Enhanced Standard Highlighting with green background
         st.sidebar.markdown(
             f"""<div style="background-color:#d4edda; padding:10px; border-radius:5px; border-left: 5px solid #28a745; margin-bottom: 8px;">
@@ -171,8 +241,9 @@ for node in strand_nodes:
         if st.sidebar.button(label, key=f"nav_{node['id']}"):
             st.session_state.current_std = node['id']
             st.session_state.student_q = None
+            st.session_state.remediation = None
             st.session_state.page = "PRACTICE"  # Exit home when selecting a standard
-            st.rerun()
+            rerun()
 
 # --- WELCOME SCREEN ---
 if st.session_state.page == "HOME":
@@ -188,24 +259,108 @@ if st.session_state.page == "HOME":
     
     **👈 Select a Strand in the sidebar to begin.**
     """)
+    metrics.end_run("home")
     st.stop()  # Stop the rest of the app from loading until they click a strand
 
+# --- TEACHER / OPS VIEW ---
+# Reads the precomputed aggregates (see analytics.py); never scans the raw attempt log
+if st.session_state.page == "INSIGHTS" and teacher_mode:
+    st.title("📊 Class Insights")
+    insights = analytics.get_analytics().refresh()
+    rows = insights.standard_rows()
+    if not rows:
+        st.info("No attempts logged yet.")
+    else:
+        total = sum(r['attempts'] for r in rows)
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Attempts", total)
+        col2.metric("Standards practised", len(rows))
+        col3.metric("Overall accuracy", f"{sum(r['correct'] for r in rows) / total:.0%}")
+
+        st.subheader("Standards (weakest first)")
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+
+        col_err, col_routes = st.columns(2)
+        with col_err:
+            st.subheader("Error types")
+            histogram = [{"error_type": err, "count": n} for err, n in insights.error_histogram().items()]
+            if histogram:
+                st.bar_chart(histogram, x="error_type", y="count")
+        with col_routes:
+            st.subheader("Gap routes")
+            st.dataframe(insights.route_rows(), use_container_width=True, hide_index=True)
+
+        st.subheader("Most common wrong answers")
+        std_choice = st.selectbox("Standard:", [r['standard_id'] for r in rows])
+        for option, count in insights.wrong_options(std_choice):
+            st.markdown(f"- {option} — **{count}**")
+
+        st.subheader("Question pools to pre-warm")
+        targets = insights.prewarm_targets()
+        st.dataframe([{"standard_id": std, "expected_demand": n} for std, n in targets],
+                     use_container_width=True, hide_index=True)
+        if st.button("🔥 Pre-warm these pools"):
+            started = analytics.prewarm(insights, curriculum)
+            st.success(f"Refilling {len(started)} pools in the background.")
+    metrics.end_run("insights")
+    st.stop()
+
 # --- MAIN APP LOGIC ---
 curr_node = curriculum[st.session_state.current_std]
 
 st.caption(f"Domain: {selected_strand['name']} > Grade {curr_node['grade']}")
 st.title(f"{curr_node['id']}: {curr_node['description']}")
 
-# TABS
-tab_practice, tab_map = st.tabs(["🎓 Adaptive Practice", "🔗 Vertical Alignment Map"])
+def go_to(std_id, **reset):
+    """Switch standards: the title, sidebar and both tabs change, so this is a full rerun.
 
-# --- TAB 1: PRACTICE ---
-with tab_practice:
+    Scaffolded remediation only lasts while the student stays on the gap they were sent to fix.
+    """
+    st.session_state.current_std = std_id
+    st.session_state.student_q = None
+    st.session_state.remediation = None
+    for key, value in reset.items():
+        st.session_state[key] = value
+    rerun()
+
+def clear_answer():
+    st.session_state.student_q = None
+    st.session_state.submitted_answer = None
+    st.session_state.is_correct = None
+
+# Each panel below is a fragment keyed only by ids, so clicks inside it rerun just that panel
+@fragment
+def hint_area(question_text):
+    if st.button("💡 Need a Hint?", use_container_width=True):
+        hint_text = ai_engine.cached_hint(question_text)
+        if hint_text is None:
+            # Stream the hint as it is generated, then settle it into the usual info box
+            hint_box = st.empty()
+            with hint_box.container():
+                hint_text = st.write_stream(ai_engine.generate_hint_stream(question_text))
+            hint_box.info(f"**💡 Hint:** {hint_text}")
+        else:
+            st.info(f"**💡 Hint:** {hint_text}")
+
+@fragment
+def practice_panel(std_id):
+    curr_node = curriculum[std_id]
+    # Arrived here through "Fix": keep the questions scaffolded for the diagnosed error
+    remediation = st.session_state.get('remediation')
+    error_context = remediation[1] if remediation and remediation[0] == std_id else None
     if not st.session_state.student_q:
         with st.spinner(f"AI is crafting a {curr_node['id']} problem..."):
-            st.session_state.student_q = ai_engine.generate_question(
-                curr_node['id'], curr_node['description']
-            )
+            # Use the question generated in the background if there is one
+            st.session_state.student_q = st.session_state.prefetcher.take(curr_node['id'], error_context)
+            if not st.session_state.student_q:
+                st.session_state.student_q = question_cache.get_question(
+                    curr_node['id'], curr_node['description'], error_context, student_id=st.session_state.student_id
+                )
+            if ai_engine.validate_question(st.session_state.student_q):
+                progress.set_current(st.session_state.student_id, curr_node['id'], st.session_state.student_q)
+
+    # Start on the next problem (and the likely remediation) while the student reads this one
+    st.session_state.prefetcher.prime(curr_node, curriculum, error_context)
 
     q = st.session_state.student_q
     if q and "question_text" in q:
@@ -217,17 +372,15 @@ with tab_practice:
         # Feature #5: Interactive Hint System
         col_hint, col_submit = st.columns([1, 1])
         with col_hint:
-            if st.button("💡 Need a Hint?", use_container_width=True):
-                with st.spinner("Generating hint..."):
-                    # Calls the engine instead of the raw client (proper separation of concerns)
-                    hint_text = ai_engine.generate_hint(q['question_text'])
-                    st.info(f"**💡 Hint:** {hint_text}")
+            hint_area(q['question_text'])
         
         with col_submit:
             submit_clicked = st.button("Submit Answer", use_container_width=True, type="primary")
         
         # Handle submission with mastery tracking
         if submit_clicked:
+            # The sidebar is outside this fragment: rerun the whole app when its badge for this standard changes
+            badge = ladder_icon(curr_node['id'])
             if answer_matches(ans, q['correct_answer']):
                 # 1. Update Streak
                 update_streak(curr_node['id'], True)
@@ -240,18 +393,31 @@ with tab_practice:
                 if current_streak >= 5:
                     st.session_state.mastery_achieved = True
                     st.session_state.mastered_ids.add(curr_node['id'])
+                    progress.add_mastered(st.session_state.student_id, curr_node['id'])
                 else:
                     st.session_state.mastery_achieved = False
-                st.rerun()
+                progress.record_attempt(st.session_state.student_id, curr_node['id'], q['question_text'],
+                                        ans, q['correct_answer'], True)
+                rerun("fragment" if ladder_icon(curr_node['id']) == badge else "app")
             else:
                 # Reset streak on wrong answer
                 update_streak(curr_node['id'], False)
                 st.session_state.submitted_answer = ans
                 st.session_state.is_correct = False
-                # Generate diagnosis immediately
-                diag = ai_engine.diagnose_gap(q['question_text'], ans, curr_node['id'])
+                # Diagnose from the error type annotated on the chosen option; only ask the AI if it's missing
+                diag = ai_engine.diagnosis_from_question(q, ans)
+                if diag is None:
+                    diag = ai_engine.diagnose_gap(q['question_text'], ans, curr_node['id'])
                 st.session_state.last_diagnosis = diag
-                st.rerun()
+                st.session_state.last_gap_id = index.gap_for(curr_node['id'], diag.get('error_type', 'CONCEPTUAL'))
+                if st.session_state.last_gap_id in curriculum:
+                    # Speculatively prepare the remediation question while the student reads the feedback
+                    st.session_state.prefetcher.speculate(curr_node['id'], curriculum[st.session_state.last_gap_id],
+                                                          diag.get('error_type', 'CONCEPTUAL'))
+                progress.record_attempt(st.session_state.student_id, curr_node['id'], q['question_text'],
+                                        ans, q['correct_answer'], False,
+                                        error_type=diag.get('error_type'), gap_id=st.session_state.last_gap_id)
+                rerun("fragment" if ladder_icon(curr_node['id']) == badge else "app")
         
         # Show feedback based on stored state
         if 'submitted_answer' in st.session_state and st.session_state.submitted_answer:
@@ -264,7 +430,7 @@ with tab_practice:
                     st.success(f"🎓 **MASTERY UNLOCKED!** You crushed {curr_node['id']}!")
                     
                     # 3. Find Unlocks (Post-requisites)
-                    unlocks = [n for nid, n in curriculum.items() if curr_node['id'] in n.get('prerequisites', {}).values()]
+                    unlocks = [curriculum[sid] for sid in index.unlocks(curr_node['id'])]
                     
                     if unlocks:
                         st.markdown("### 🔓 You unlocked new skills:")
@@ -273,12 +439,8 @@ with tab_practice:
                             with cols[idx]:
                                 st.info(f"**{next_node['id']}**\n\n{next_node['description']}")
                                 if st.button(f"🚀 Start {next_node['id']}", key=f"adv_{next_node['id']}"):
-                                    st.session_state.current_std = next_node['id']
-                                    st.session_state.student_q = None
-                                    st.session_state.submitted_answer = None
-                                    st.session_state.is_correct = None
-                                    st.session_state.mastery_achieved = None
-                                    st.rerun()
+                                    go_to(next_node['id'], submitted_answer=None, is_correct=None,
+                                          mastery_achieved=None)
                     else:
                         st.success("🏆 You have reached the top of this branch! Pick a new strand in the sidebar.")
                 else:
@@ -286,10 +448,8 @@ with tab_practice:
                     st.success(f"✅ Correct! Streak: {current_streak}/5 🔥")
                     st.progress(current_streak / 5)
                     if st.button("Next Problem"):
-                        st.session_state.student_q = None
-                        st.session_state.submitted_answer = None
-                        st.session_state.is_correct = None
-                        st.rerun()
+                        clear_answer()
+                        rerun("fragment")
             else:
                 # Incorrect answer - show diagnosis and recovery options
                 st.error("❌ Incorrect. Streak reset to 0. The AI detected a gap in your foundation.")
@@ -297,43 +457,28 @@ with tab_practice:
                 diag = st.session_state.get('last_diagnosis', {'error_type': 'CONCEPTUAL', 'explanation': 'Unable to diagnose.'})
                 st.info(f"**AI Insight:** {diag['explanation']}")
                 
-                err_type = diag.get('error_type', 'CONCEPTUAL')
-                prereqs = curr_node.get('prerequisites', {})
-                
                 # Recovery Path: Try Again or Fix Gap
                 col_retry, col_fix = st.columns(2)
                 with col_retry:
                     if st.button("🔄 Try Problem Again", use_container_width=True):
                         # Clear all state
-                        st.session_state.student_q = None
-                        st.session_state.submitted_answer = None
-                        st.session_state.is_correct = None
+                        clear_answer()
                         st.session_state.last_diagnosis = None
-                        st.rerun()
+                        rerun("fragment")
                 
                 with col_fix:
-                    # Find the gap to fix: exact match first, then fallback to first prerequisite
-                    gap_id = None
-                    if err_type in prereqs:
-                        gap_id = prereqs[err_type]
-                    elif prereqs:
-                        # Fallback: use the first prerequisite when exact type doesn't match
-                        gap_id = list(prereqs.values())[0]
-                    
+                    gap_id = st.session_state.get('last_gap_id')
                     if gap_id and gap_id in curriculum:
                         gap_node = curriculum[gap_id]
                         st.markdown(f"**🚨 Gap Found:** {gap_node['id']}")
                         st.caption(f"{gap_node['description']}")
                         if st.button(f"🚑 Fix {gap_node['id']} Now", type="primary", use_container_width=True):
-                            st.session_state.current_std = gap_id
-                            st.session_state.student_q = None
-                            st.session_state.submitted_answer = None
-                            st.session_state.is_correct = None
-                            st.session_state.last_diagnosis = None
-                            st.rerun()
+                            go_to(gap_id, submitted_answer=None, is_correct=None, last_diagnosis=None,
+                                  remediation=(gap_id, diag.get('error_type', 'CONCEPTUAL')))
 
-# --- TAB 2: THE MAP ---
-with tab_map:
+@fragment
+def alignment_map(std_id):
+    curr_node = curriculum[std_id]
     st.markdown("### 🗺️ Where does this fit?")
     col1, col2, col3 = st.columns(3)
     
@@ -350,21 +495,34 @@ with tab_map:
                     st.markdown(f"**{r_type}** → `{pid}`")
                     st.caption(f"_{p['description']}_")
                     if st.button(f"⬅️ Go to {pid} (Gr {p['grade']})", key=f"pre_{pid}"):
-                         st.session_state.current_std = pid
-                         st.session_state.student_q = None
-                         st.rerun()
+                        go_to(pid)
         else:
             st.info("🌱 This is a foundation standard - no prerequisites!")
     with col3:
         st.markdown("**UNLOCKS (Post-requisites):**")
-        unlocks = [n for nid, n in curriculum.items() if curr_node['id'] in n.get('prerequisites', {}).values()]
+        unlocks = [curriculum[sid] for sid in index.unlocks(curr_node['id'])]
         if unlocks:
             for node in unlocks:
                 st.markdown(f"`{node['id']}`")
                 st.caption(f"_{node['description']}_")
                 if st.button(f"➡️ Go to {node['id']} (Gr {node['grade']})", key=f"post_{node['id']}"):
-                     st.session_state.current_std = node['id']
-                     st.session_state.student_q = None
-                     st.rerun()
+                    go_to(node['id'])
         else:
             st.info("🎯 This is a capstone standard - end of this path!")
+
+if ai_engine.needs_api_key():
+    st.error("⚠️ GEMINI_API_KEY not found! Add it to .streamlit/secrets.toml or set as environment variable.")
+    st.stop()
+
+# TABS
+tab_practice, tab_map = st.tabs(["🎓 Adaptive Practice", "🔗 Vertical Alignment Map"])
+
+# --- TAB 1: PRACTICE ---
+with tab_practice:
+    practice_panel(curr_node['id'])
+
+# --- TAB 2: THE MAP ---
+with tab_map:
+    alignment_map(curr_node['id'])
+
+metrics.end_run()
@@ -0,0 +1,182 @@
+"""Build the offline question bank for every standard in curriculum.json.
+
+Usage:
+    python build_bank.py --per-level 10 --workers 8
+    python build_bank.py --resume          # continue a partial run
+
+Each standard gets a "normal" level plus one scaffolded level per error type that
+routes a student to it from another standard. Items are validated, near-duplicates
+are dropped, and the result is written as JSONL plus an offset index (see question_bank.py).
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ai_engine
+import question_bank
+import question_cache
+
+# Questions whose word 3-shingles overlap at least this much are treated as duplicates
+DUPLICATE_THRESHOLD = 0.8
+
+_WORD = re.compile(r"[a-z0-9.]+")
+
+def load_nodes(path='curriculum.json'):
+    with open(path, 'r') as f:
+        return json.load(f)['nodes']
+
+def levels_for(nodes):
+    """Map each standard to the error contexts it can be generated for (None = normal difficulty)."""
+    levels = {sid: [None] for sid in nodes}
+    for node in nodes.values():
+        for err_type, pid in node.get('prerequisites', {}).items():
+            if pid in levels and err_type not in levels[pid]:
+                levels[pid].append(err_type)
+    return levels
+
+def latex_ok(text):
+    """Cheap LaTeX sanity check: balanced $ delimiters and balanced braces inside them."""
+    if not isinstance(text, str):
+        return False
+    unescaped = text.replace("\\$", "")
+    if unescaped.count("$") % 2:
+        return False
+    depth = 0
+    for ch in unescaped.replace("\\{", "").replace("\\}", ""):
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+def validate_item(q):
+    if not ai_engine.validate_question(q):
+        return False
+    return latex_ok(q['question_text']) and all(latex_ok(o) for o in q['options'])
+
+def shingles(text):
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+
+def is_duplicate(sig, existing):
+    for other in existing:
+        union = len(sig | other)
+        if union and len(sig & other) / union >= DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+class BankWriter:
+    """Appends accepted questions to the bank, deduplicating per key. Thread-safe."""
+
+    def __init__(self, path, resume):
+        self.path = path
+        self.signatures = {}  # cache key -> list of shingle sets
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._load_existing()
+        else:
+            open(path, 'w').close()
+        self._out = open(path, 'a')
+
+    def _load_existing(self):
+        good_bytes = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good_bytes += len(line)
+                self.signatures.setdefault(record['key'], []).append(shingles(record['question']['question_text']))
+        # Drop a half-written trailing line from an interrupted run
+        with open(self.path, 'r+b') as f:
+            f.truncate(good_bytes)
+
+    def count(self, key):
+        with self._lock:
+            return len(self.signatures.get(key, ()))
+
+    def add(self, standard_id, error_context, q):
+        """Write q unless it duplicates an existing item; returns True if it was written."""
+        key = question_cache.cache_key(standard_id, error_context)
+        sig = shingles(q['question_text'])
+        with self._lock:
+            existing = self.signatures.setdefault(key, [])
+            if is_duplicate(sig, existing):
+                return False
+            existing.append(sig)
+            record = {
+                "key": key,
+                "standard_id": standard_id,
+                "bucket": question_cache.difficulty_bucket(error_context),
+                "prompt_version": ai_engine.PROMPT_VERSION,
+                "question": q,
+            }
+            self._out.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._out.flush()
+            return True
+
+    def close(self):
+        self._out.close()
+        question_bank.write_index(self.path, question_bank.build_index(self.path))
+
+def fill_level(writer, node, error_context, per_level, max_attempts, batch_size):
+    """Generate in batches until this (standard, level) has per_level items or attempts run out."""
+    key = question_cache.cache_key(node['id'], error_context)
+    rejected = 0
+    for _ in range(max_attempts):
+        missing = per_level - writer.count(key)
+        if missing <= 0:
+            break
+        n = min(missing, batch_size)
+        batch = ai_engine.generate_questions(node['id'], node['description'], n, error_context)
+        rejected += n - len(batch)
+        for q in batch:
+            if not (validate_item(q) and writer.add(node['id'], error_context, q)):
+                rejected += 1
+    return key, writer.count(key), rejected
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the offline question bank.")
+    parser.add_argument("--curriculum", default="curriculum.json")
+    parser.add_argument("--out", default=question_bank.BANK_PATH)
+    parser.add_argument("--per-level", type=int, default=10, help="questions per standard and difficulty level")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent generation requests")
+    parser.add_argument("--batch-size", type=int, default=5, help="questions requested per model call")
+    parser.add_argument("--max-attempts", type=int, default=0,
+                        help="batched generation calls allowed per level (default: 3x --per-level)")
+    parser.add_argument("--standards", nargs="*", help="only build these standard ids")
+    parser.add_argument("--resume", action="store_true", help="keep existing items and only fill what is missing")
+    args = parser.parse_args(argv)
+
+    nodes = load_nodes(args.curriculum)
+    levels = levels_for(nodes)
+    if args.standards:
+        levels = {sid: lv for sid, lv in levels.items() if sid in args.standards}
+    max_attempts = args.max_attempts or 3 * args.per_level
+
+    writer = BankWriter(args.out, args.resume)
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = [
+                pool.submit(fill_level, writer, nodes[sid], err, args.per_level, max_attempts, args.batch_size)
+                for sid, lv in levels.items() for err in lv
+            ]
+            for future in as_completed(futures):
+                key, have, rejected = future.result()
+                status = "ok" if have >= args.per_level else "SHORT"
+                print(f"[{status}] {key}: {have}/{args.per_level} ({rejected} rejected)", file=sys.stderr)
+    finally:
+        writer.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Precompiled, read-only index over curriculum.json.
+
+Loaded once per process. Every lookup the UI needs (prerequisites, unlocks, strand
+ladders) is a dict access; transitive closures and topological order are computed
+at load time, when the graph is also checked for cycles and dangling references.
+"""
+import functools
+import json
+from types import MappingProxyType
+
+CURRICULUM_PATH = 'curriculum.json'
+
+class CurriculumError(ValueError):
+    """curriculum.json describes an invalid prerequisite graph."""
+
+class CurriculumIndex:
+    """Immutable view of the curriculum graph. Edges point from a standard to its prerequisites."""
+
+    def __init__(self, data):
+        nodes = data['nodes']
+        strands = data.get('strands', {})
+        _validate(nodes, strands)
+
+        # Forward edges: standard -> {error_type: prerequisite id}
+        self._prereqs = MappingProxyType({
+            sid: MappingProxyType(dict(n.get('prerequisites', {}))) for sid, n in nodes.items()
+        })
+        self.nodes = MappingProxyType({
+            sid: MappingProxyType({**n, 'prerequisites': self._prereqs[sid]}) for sid, n in nodes.items()
+        })
+        self.strands = MappingProxyType({
+            k: MappingProxyType({**s, 'standards': tuple(s.get('standards', ()))}) for k, s in strands.items()
+        })
+
+        # Reverse edges: standard -> standards that list it as a prerequisite
+        unlocks = {sid: [] for sid in nodes}
+        for sid, n in nodes.items():
+            for pid in dict.fromkeys(n.get('prerequisites', {}).values()):
+                unlocks[pid].append(sid)
+        self._unlocks = MappingProxyType({sid: tuple(ids) for sid, ids in unlocks.items()})
+
+        self.topological_order = _topological_order(nodes)
+
+        # Transitive prerequisite closure, built bottom-up in topological order
+        ancestors = {}
+        for sid in self.topological_order:
+            closure = set()
+            for pid in self._prereqs[sid].values():
+                closure.add(pid)
+                closure |= ancestors[pid]
+            ancestors[sid] = frozenset(closure)
+        self._ancestors = MappingProxyType(ancestors)
+
+        # Strand ladders, highest grade first (the sidebar's order)
+        self._ladders = MappingProxyType({
+            key: tuple(sorted((sid for sid in s['standards'] if sid in nodes),
+                              key=lambda sid: nodes[sid]['grade'], reverse=True))
+            for key, s in strands.items()
+        })
+
+    def __contains__(self, std_id):
+        return std_id in self.nodes
+
+    def node(self, std_id):
+        return self.nodes[std_id]
+
+    def prerequisites(self, std_id):
+        """{error_type: prerequisite id} for a standard."""
+        return self._prereqs[std_id]
+
+    def unlocks(self, std_id):
+        """Ids of the standards that list std_id as a direct prerequisite."""
+        return self._unlocks[std_id]
+
+    def ancestors(self, std_id):
+        """Every standard reachable through prerequisites (transitively)."""
+        return self._ancestors[std_id]
+
+    def ladder(self, strand_key):
+        """Ids of a strand's standards sorted by grade, highest first."""
+        return self._ladders[strand_key]
+
+    def gap_for(self, std_id, err_type):
+        """Prerequisite to remediate an error: exact error-type match, else the first prerequisite."""
+        prereqs = self._prereqs[std_id]
+        if err_type in prereqs:
+            return prereqs[err_type]
+        return next(iter(prereqs.values()), None)
+
+def _validate(nodes, strands):
+    for sid, n in nodes.items():
+        if n.get('id') != sid:
+            raise CurriculumError(f"Node {sid!r} has mismatched id {n.get('id')!r}")
+        for err_type, pid in n.get('prerequisites', {}).items():
+            if pid not in nodes:
+                raise CurriculumError(f"{sid} lists unknown prerequisite {pid!r} ({err_type})")
+    for key, s in strands.items():
+        missing = [sid for sid in s.get('standards', []) if sid not in nodes]
+        if missing:
+            raise CurriculumError(f"Strand {key} references unknown standards: {', '.join(missing)}")
+
+def _topological_order(nodes):
+    """Prerequisites before the standards that need them (Kahn's algorithm); raises on cycles."""
+    remaining = {sid: len(set(n.get('prerequisites', {}).values())) for sid, n in nodes.items()}
+    dependents = {sid: [] for sid in nodes}
+    for sid, n in nodes.items():
+        for pid in set(n.get('prerequisites', {}).values()):
+            dependents[pid].append(sid)
+    ready = [sid for sid, count in remaining.items() if count == 0]
+    order = []
+    while ready:
+        sid = ready.pop()
+        order.append(sid)
+        for dep in dependents[sid]:
+            remaining[dep] -= 1
+            if remaining[dep] == 0:
+                ready.append(dep)
+    if len(order) != len(nodes):
+        cyclic = sorted(sid for sid, count in remaining.items() if count)
+        raise CurriculumError(f"Prerequisite cycle involving: {', '.join(cyclic)}")
+    return tuple(order)
+
+@functools.lru_cache(maxsize=None)
+def load_index(path=CURRICULUM_PATH):
+    """Load and index curriculum.json once per process."""
+    with open(path, 'r') as f:
+        return CurriculumIndex(json.load(f))
@@ -0,0 +1,307 @@
+"""Model backends behind ai_engine: the real Gemini client and a deterministic local fake.
+
+Select with the LLM_BACKEND environment variable ("gemini" or "fake"). The model used
+for each call type can be set with LLM_MODEL_QUESTION, LLM_MODEL_DIAGNOSIS and
+LLM_MODEL_HINT (falling back to LLM_MODEL), so tiers can be switched without code edits.
+
+Each call carries a fixed system instruction and (for JSON calls) a response schema.
+GeminiBackend puts the system instruction in a server-side context cache when
+LLM_CONTEXT_CACHE=1 (the default), the instruction is at least LLM_CONTEXT_CACHE_MIN_TOKENS
+long and the model accepts it, and sends it inline otherwise.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+CALL_TYPES = ("question", "question_batch", "diagnosis", "hint")
+
+CONTEXT_CACHE = os.environ.get("LLM_CONTEXT_CACHE", "1") == "1"
+CONTEXT_CACHE_TTL = int(os.environ.get("LLM_CONTEXT_CACHE_TTL", "3600"))
+# Gemini rejects explicit caches below a per-model minimum size (1024 tokens for the Flash models);
+# smaller instructions are always sent inline
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("LLM_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+# After a failed cache creation or token count, retry this much later
+CONTEXT_CACHE_RETRY = 600
+# Text averages about four characters a token and seldom fewer than two, so an instruction
+# shorter than this many characters per minimum token can't reach the minimum
+MIN_CHARS_PER_TOKEN = 2
+
+def cacheable(instruction_tokens):
+    """True when an instruction of this size goes into a context cache instead of inline."""
+    return CONTEXT_CACHE and instruction_tokens >= CONTEXT_CACHE_MIN_TOKENS
+
+# Text plus token usage reported by the provider (None when unknown).
+# prompt_tokens includes cached_tokens, the part served from a context cache.
+LLMResult = namedtuple("LLMResult", ["text", "prompt_tokens", "output_tokens", "cached_tokens"],
+                       defaults=(None,))
+
+class BackendError(Exception):
+    """A backend call failed. `code` carries the HTTP-style status when there is one."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+def models_from_env():
+    default = os.environ.get("LLM_MODEL", DEFAULT_MODEL)
+    return {
+        "question": os.environ.get("LLM_MODEL_QUESTION", default),
+        "question_batch": os.environ.get("LLM_MODEL_QUESTION", default),
+        "diagnosis": os.environ.get("LLM_MODEL_DIAGNOSIS", default),
+        "hint": os.environ.get("LLM_MODEL_HINT", default),
+    }
+
+class LLMBackend:
+    """Interface for a text-generation provider.
+
+    `call_type` is one of CALL_TYPES. `system_instruction` is the fixed part of the
+    prompt for that call type and `response_schema` the expected JSON shape (or None).
+    `params` carry the structured request (standard_id, n, ...) for backends that
+    don't need to parse the prompt.
+    """
+
+    def __init__(self, models=None):
+        self.models = models or models_from_env()
+
+    def model_for(self, call_type):
+        return self.models.get(call_type, DEFAULT_MODEL)
+
+    def generate(self, call_type, prompt, json_mode=False, system_instruction=None, response_schema=None,
+                 **params):
+        """Return an LLMResult for the whole response."""
+        raise NotImplementedError
+
+    def generate_stream(self, call_type, prompt, system_instruction=None, **params):
+        """Yield the response text in chunks."""
+        yield self.generate(call_type, prompt, system_instruction=system_instruction, **params).text
+
+class GeminiBackend(LLMBackend):
+    """google-genai client; `client_factory` returns a configured genai.Client."""
+
+    def __init__(self, client_factory, models=None, context_cache=CONTEXT_CACHE):
+        super().__init__(models)
+        self.client_factory = client_factory
+        self.context_cache = context_cache
+        self._caches = {}  # (model, instruction digest) -> (cache name or None, valid until)
+        self._creating = set()  # keys with a create (or token count) in flight
+        self._cache_lock = threading.Lock()
+
+    def _cached_content(self, model, system_instruction):
+        """Name of a context cache holding system_instruction, or None to send it inline."""
+        if not self.context_cache or not system_instruction:
+            return None
+        # Keyed by the instruction text itself, so a prompt change never reuses a stale cache
+        key = (model, hashlib.sha256(system_instruction.encode()).hexdigest())
+        with self._cache_lock:
+            entry = self._caches.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+            if key in self._creating:
+                # Another thread is on it; send this call inline rather than wait
+                return None
+            self._creating.add(key)
+        # Network calls happen outside the lock so other model traffic never queues behind them
+        try:
+            entry = self._create_cache(model, system_instruction, key)
+        finally:
+            with self._cache_lock:
+                self._creating.discard(key)
+        with self._cache_lock:
+            self._caches[key] = entry
+        return entry[0]
+
+    def _create_cache(self, model, system_instruction, key):
+        from google.genai import types
+        if len(system_instruction) < CONTEXT_CACHE_MIN_TOKENS * MIN_CHARS_PER_TOKEN:
+            # Clearly below the minimum: skip the token count, an extra unscheduled round trip
+            return None, float("inf")
+        client = self.client_factory()
+        try:
+            tokens = client.models.count_tokens(model=model, contents=system_instruction).total_tokens
+        except Exception:
+            return None, time.monotonic() + CONTEXT_CACHE_RETRY
+        if not cacheable(tokens or 0):
+            # Below the minimum: the instruction never changes size, so don't ask again
+            return None, float("inf")
+        try:
+            cache = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    ttl=f"{CONTEXT_CACHE_TTL}s",
+                    display_name=f"pathfinder-{key[1][:12]}",
+                ),
+            )
+        except Exception:
+            # Unsupported model or a minimum above LLM_CONTEXT_CACHE_MIN_TOKENS
+            return None, time.monotonic() + CONTEXT_CACHE_RETRY
+        # Renew a minute early rather than race the server-side expiry
+        return cache.name, time.monotonic() + CONTEXT_CACHE_TTL - 60
+
+    def _forget_cache(self, model, system_instruction):
+        key = (model, hashlib.sha256(system_instruction.encode()).hexdigest())
+        with self._cache_lock:
+            self._caches.pop(key, None)
+
+    def _config(self, cached, system_instruction, json_mode=False, response_schema=None):
+        from google.genai import types
+        config = {}
+        if cached:
+            config["cached_content"] = cached
+        elif system_instruction:
+            config["system_instruction"] = system_instruction
+        if json_mode:
+            config["response_mime_type"] = "application/json"
+            if response_schema:
+                config["response_schema"] = response_schema
+        return types.GenerateContentConfig(**config) if config else None
+
+    def generate(self, call_type, prompt, json_mode=False, system_instruction=None, response_schema=None,
+                 **params):
+        model = self.model_for(call_type)
+        cached = self._cached_content(model, system_instruction)
+        try:
+            response = self.client_factory().models.generate_content(
+                model=model,
+                contents=prompt,
+                config=self._config(cached, system_instruction, json_mode, response_schema)
+            )
+        except Exception as e:
+            code = getattr(e, 'code', None)
+            if not cached or code == 429 or (isinstance(code, int) and code >= 500):
+                raise
+            # The cache may have been evicted server-side: drop it and send the instruction inline
+            self._forget_cache(model, system_instruction)
+            response = self.client_factory().models.generate_content(
+                model=model,
+                contents=prompt,
+                config=self._config(None, system_instruction, json_mode, response_schema)
+            )
+        usage = getattr(response, 'usage_metadata', None)
+        return LLMResult(
+            response.text,
+            getattr(usage, 'prompt_token_count', None),
+            getattr(usage, 'candidates_token_count', None),
+            getattr(usage, 'cached_content_token_count', None),
+        )
+
+    def generate_stream(self, call_type, prompt, system_instruction=None, **params):
+        model = self.model_for(call_type)
+        cached = self._cached_content(model, system_instruction)
+        for chunk in self.client_factory().models.generate_content_stream(
+            model=model,
+            contents=prompt,
+            config=self._config(cached, system_instruction)
+        ):
+            if chunk.text:
+                yield chunk.text
+
+class FakeBackend(LLMBackend):
+    """Deterministic offline stand-in that returns schema-valid responses.
+
+    latency: seconds per call (a (low, high) tuple draws uniformly from the range).
+    failure_rate: fraction of calls that raise BackendError (code 429 or 503).
+    The same seed and sequence of requests always produces the same outputs.
+    """
+
+    ERROR_TYPES = ("ARITHMETIC", "CONCEPTUAL", "ALGEBRAIC", "SKILL", "GRAPHICAL", "GEOMETRIC")
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0, models=None):
+        super().__init__(models)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.calls = 0
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, call_type, prompt, params):
+        """One RNG per request, seeded by the request and how often it has been made before."""
+        ident = json.dumps([call_type, sorted(params.items())], default=str) if params else call_type + prompt
+        with self._lock:
+            self.calls += 1
+            n = self._counters[ident] = self._counters.get(ident, 0) + 1
+        digest = hashlib.sha256(f"{self.seed}|{ident}|{n}".encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _simulate(self, rng):
+        low, high = self.latency if isinstance(self.latency, tuple) else (self.latency, self.latency)
+        delay = rng.uniform(low, high)
+        if delay > 0:
+            time.sleep(delay)
+        if self.failure_rate and rng.random() < self.failure_rate:
+            raise BackendError("Injected fake backend failure", code=rng.choice((429, 503)))
+
+    def generate(self, call_type, prompt, json_mode=False, system_instruction=None, response_schema=None,
+                 **params):
+        rng = self._rng(call_type, prompt, params)
+        self._simulate(rng)
+        if call_type == "question":
+            payload = self._question(rng, params, response_schema)
+        elif call_type == "question_batch":
+            payload = {"questions": [self._question(rng, params, response_schema)
+                                     for _ in range(params.get('n', 1))]}
+        elif call_type == "diagnosis":
+            payload = {"error_type": rng.choice(self.ERROR_TYPES), "explanation": "Fake diagnosis for load testing."}
+        else:
+            payload = None
+        text = json.dumps(payload) if payload is not None else self._hint(rng)
+        # Roughly four characters per token; the fake has no context cache
+        return LLMResult(text, (len(system_instruction or "") + len(prompt)) // 4, len(text) // 4, 0)
+
+    def generate_stream(self, call_type, prompt, system_instruction=None, **params):
+        text = self.generate(call_type, prompt, system_instruction=system_instruction, **params).text
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+
+    def _question(self, rng, params, response_schema=None):
+        a, b = rng.randint(2, 60), rng.randint(2, 60)
+        answer = a + b
+        wrong = {str(a - b): "SKILL", str(answer + 10): "ARITHMETIC", str(a * b): "CONCEPTUAL"}
+        if len(wrong) < 3 or str(answer) in wrong:
+            wrong = {str(answer + 1): "ARITHMETIC", str(answer - 10): "ARITHMETIC", str(answer * 2): "CONCEPTUAL"}
+        options = [str(answer)] + list(wrong)
+        rng.shuffle(options)
+        question = {
+            "question_text": f"[{params.get('standard_id', 'STD')}] A rover drives ${a}$ km, then ${b}$ km more. "
+                             f"How far did it drive in total?",
+            "solution_steps": f"${a} + {b} = {answer}$",
+            "correct_answer": str(answer),
+            "options": options,
+        }
+        if response_schema is not None:
+            # Same shape as the real model under ai_engine's response schema
+            question["distractors"] = [{"option": opt, "error_type": err, "why": f"Fake misconception ({err.lower()})."}
+                                       for opt, err in wrong.items()]
+        else:
+            question["analysis"] = {opt: f"Fake misconception ({err.lower()})." for opt, err in wrong.items()}
+            question["error_types"] = wrong
+        return question
+
+    def _hint(self, rng):
+        return rng.choice((
+            "Start by writing down what the problem gives you, e.g. $a$ and $b$.",
+            "Which operation combines the two quantities? Try it with smaller numbers first.",
+            "Draw a quick diagram and label each quantity before computing.",
+        ))
+
+def backend_from_env(client_factory):
+    """Build the backend named by LLM_BACKEND ("gemini" by default)."""
+    name = os.environ.get("LLM_BACKEND", "gemini").lower()
+    if name == "fake":
+        low = float(os.environ.get("FAKE_LLM_LATENCY", "0"))
+        high = float(os.environ.get("FAKE_LLM_LATENCY_MAX", str(low)))
+        return FakeBackend(
+            latency=(low, high),
+            failure_rate=float(os.environ.get("FAKE_LLM_FAILURE_RATE", "0")),
+            seed=int(os.environ.get("FAKE_LLM_SEED", "0")),
+        )
+    if name == "gemini":
+        return GeminiBackend(client_factory)
+    raise ValueError(f"Unknown LLM_BACKEND {name!r} (expected 'gemini' or 'fake')")
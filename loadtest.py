@@ -0,0 +1,287 @@
+"""Concurrent-session load test for app.py against the offline fake backend.
+
+Drives many simulated students through Streamlit's AppTest harness, each following a
+scripted path (pick a strand, answer right and wrong, ask for hints, follow the
+"Fix" gap route), and reports per-interaction latency percentiles, script reruns,
+fragment runs, peak memory per session and throughput.
+
+AppTest always re-executes the whole script, so fragment-scoped reruns show up here
+as full runs; on a live server compare the pathfinder_script_runs_total counter by
+kind ("script" vs "fragment") instead.
+
+AppTest swaps a process-global runtime while a script runs, so each worker process
+drives one session at a time; concurrency comes from --concurrency worker processes
+sharing the same on-disk question cache.
+
+Usage:
+    python loadtest.py --sessions 200 --concurrency 50 --latency 0.5
+    python loadtest.py --save benchmarks/baseline.json
+    python loadtest.py --compare benchmarks/baseline.json   # exit 1 on regression
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PATHS = ("mastery_run", "wrong_then_fix", "hint_then_answer")
+# A metric this much worse than the baseline counts as a regression
+REGRESSION_TOLERANCE = 0.20
+
+def configure_environment(args):
+    """Point the app at the fake backend and a throwaway cache before anything imports ai_engine."""
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+    os.environ["FAKE_LLM_LATENCY_MAX"] = str(args.latency_max if args.latency_max is not None else args.latency)
+    os.environ["FAKE_LLM_FAILURE_RATE"] = str(args.failure_rate)
+    os.environ["FAKE_LLM_SEED"] = str(args.seed)
+    os.environ["QUESTION_CACHE_PATH"] = os.path.join(workdir, "question_cache.db")
+    os.environ["PROGRESS_DB_PATH"] = os.path.join(workdir, "progress.db")
+    os.environ.setdefault("QUESTION_BANK_PATH", os.path.join(workdir, "no_bank.jsonl"))
+    # AppTest resolves curriculum.json relative to the working directory, like `streamlit run`
+    os.chdir(os.path.dirname(APP_PATH))
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+class Recorder:
+    """Interaction timings, rerun counts and per-session memory peaks from one worker."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.reruns = {}
+        self.fragment_runs = {}
+        self.peaks = []
+        self.max_rss_kb = 0
+        self.errors = 0
+
+    def add(self, name, seconds, reruns, fragment_runs):
+        self.latencies.setdefault(name, []).append(seconds)
+        self.reruns.setdefault(name, []).append(reruns)
+        self.fragment_runs.setdefault(name, []).append(fragment_runs)
+
+    def merge(self, other):
+        """Fold in a worker's results (passed as a plain dict: AppTest replaces __main__, so
+        classes defined here can't be pickled back from worker processes)."""
+        for name, values in other['latencies'].items():
+            self.latencies.setdefault(name, []).extend(values)
+            self.reruns.setdefault(name, []).extend(other['reruns'][name])
+            self.fragment_runs.setdefault(name, []).extend(other['fragment_runs'][name])
+        self.peaks.extend(other['peaks'])
+        self.max_rss_kb = max(self.max_rss_kb, other['max_rss_kb'])
+        self.errors += other['errors']
+
+class Student:
+    """One simulated browser session."""
+
+    def __init__(self, recorder, rng, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.recorder = recorder
+        self.rng = rng
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def _runs(self):
+        state = self.at.session_state
+        script = state['script_runs'] if 'script_runs' in state else 0
+        fragments = sum(state['fragment_runs'].values()) if 'fragment_runs' in state else 0
+        return script, fragments
+
+    def step(self, name, action):
+        script_before, fragments_before = self._runs()
+        start = time.perf_counter()
+        action()
+        self.at.run()
+        elapsed = time.perf_counter() - start
+        if self.at.exception:
+            raise RuntimeError(f"{name}: {self.at.exception[0].message}")
+        script_after, fragments_after = self._runs()
+        self.recorder.add(name, elapsed, script_after - script_before, fragments_after - fragments_before)
+
+    def button(self, predicate):
+        for b in self.at.button:
+            if predicate(b):
+                return b
+        return None
+
+    def open_standard(self):
+        self.step("load", lambda: None)
+        strand = self.rng.choice(self.at.sidebar.selectbox[0].options)
+        self.step("pick_strand", lambda: self.at.sidebar.selectbox[0].select(strand))
+        nav = [b for b in self.at.button if b.key and b.key.startswith("nav_")]
+        choice = self.rng.choice(nav)
+        self.step("open_standard", choice.click)
+
+    def answer(self, correct):
+        q = self.at.session_state['student_q']
+        options = q.get('options', [])
+        if correct or len(options) < 2:
+            pick = q['correct_answer']
+        else:
+            pick = self.rng.choice([o for o in options if o != q['correct_answer']])
+        self.at.radio(key="main_q").set_value(pick)
+        submit = self.button(lambda b: b.label == "Submit Answer")
+        self.step("submit_correct" if correct else "submit_wrong", submit.click)
+
+    def next_problem(self):
+        nxt = self.button(lambda b: b.label == "Next Problem")
+        if nxt is not None:
+            self.step("next_problem", nxt.click)
+
+    def hint(self):
+        hint = self.button(lambda b: b.label.startswith("💡"))
+        self.step("hint", hint.click)
+
+    def fix_gap(self):
+        fix = self.button(lambda b: b.label.startswith("🚑"))
+        if fix is not None:
+            self.step("fix_gap", fix.click)
+        else:
+            retry = self.button(lambda b: b.label.startswith("🔄"))
+            self.step("try_again", retry.click)
+
+    def run_path(self, path):
+        self.open_standard()
+        if path == "mastery_run":
+            for _ in range(3):
+                self.answer(correct=True)
+                self.next_problem()
+        elif path == "wrong_then_fix":
+            self.answer(correct=False)
+            self.fix_gap()
+            self.answer(correct=True)
+        else:
+            self.hint()
+            self.hint()  # second click should be served from the hint cache
+            self.answer(correct=self.rng.random() < 0.5)
+
+def run_sessions(session_ids, args):
+    """Worker process: run the given sessions one after another, tracking each one's memory peak."""
+    recorder = Recorder()
+    if args.trace_memory:
+        tracemalloc.start()
+    for i in session_ids:
+        rng = random.Random(args.seed * 100003 + i)
+        if args.trace_memory:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+        try:
+            Student(recorder, rng, args.timeout).run_path(PATHS[i % len(PATHS)])
+        except Exception as e:
+            recorder.errors += 1
+            if args.verbose:
+                print(f"session {i} failed: {e}", file=sys.stderr)
+        if args.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            recorder.peaks.append(peak - base)
+    if args.trace_memory:
+        tracemalloc.stop()
+    recorder.max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return vars(recorder)
+
+def summarize(recorder, args, wall):
+    interactions = {}
+    for name, values in sorted(recorder.latencies.items()):
+        runs = recorder.reruns[name]
+        fragment_runs = recorder.fragment_runs[name]
+        interactions[name] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p90_ms": round(percentile(values, 90) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(max(values) * 1000, 2),
+            "mean_script_runs": round(sum(runs) / len(runs), 3),
+            "mean_fragment_runs": round(sum(fragment_runs) / len(fragment_runs), 3),
+        }
+    total = sum(len(v) for v in recorder.latencies.values())
+    return {
+        "config": {
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "latency_s": args.latency,
+            "latency_max_s": args.latency_max,
+            "failure_rate": args.failure_rate,
+            "seed": args.seed,
+        },
+        "interactions": interactions,
+        "total_interactions": total,
+        "failed_sessions": recorder.errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(total / wall, 2) if wall else 0.0,
+        # Only measured with --trace-memory (tracemalloc slows every interaction down noticeably)
+        "peak_mem_per_session_kb": round(max(recorder.peaks) / 1024, 1) if recorder.peaks else None,
+        "max_worker_rss_kb": recorder.max_rss_kb,
+    }
+
+def compare(result, baseline):
+    """Return human-readable regressions of result against a saved baseline."""
+    problems = []
+    for name, now in result["interactions"].items():
+        before = baseline.get("interactions", {}).get(name)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p90_ms", "p99_ms", "mean_script_runs", "mean_fragment_runs"):
+            if before.get(metric) and now[metric] > before[metric] * (1 + REGRESSION_TOLERANCE):
+                problems.append(f"{name}.{metric}: {before[metric]} -> {now[metric]}")
+    if baseline.get("throughput_per_s") and \
+            result["throughput_per_s"] < baseline["throughput_per_s"] * (1 - REGRESSION_TOLERANCE):
+        problems.append(f"throughput_per_s: {baseline['throughput_per_s']} -> {result['throughput_per_s']}")
+    for metric in ("peak_mem_per_session_kb", "max_worker_rss_kb"):
+        before, now = baseline.get(metric), result.get(metric)
+        if before and now and now > before * (1 + REGRESSION_TOLERANCE):
+            problems.append(f"{metric}: {before} -> {now}")
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test app.py with simulated concurrent students.")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--latency-max", type=float, help="upper bound for a uniformly random latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="measure each session's peak allocations")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-rerun timeout in seconds")
+    parser.add_argument("--save", help="write the results JSON here (e.g. benchmarks/baseline.json)")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    configure_environment(args)
+    recorder = Recorder()
+    workers = max(min(args.concurrency, args.sessions), 1)
+    shards = [list(range(w, args.sessions, workers)) for w in range(workers)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part in pool.map(run_sessions, shards, [args] * workers):
+            recorder.merge(part)
+    wall = time.perf_counter() - start
+
+    result = summarize(recorder, args, wall)
+    print(json.dumps(result, indent=2))
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(result, json.load(f))
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
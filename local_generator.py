@@ -0,0 +1,208 @@
+"""Template-based question generator for purely procedural standards (no model call).
+
+Each template draws parameters, computes the exact answer with integers/Fraction,
+and builds distractors from specific misconceptions tagged with the same error
+categories diagnose_gap uses. Output has the same shape as ai_engine.generate_question.
+"""
+import os
+import random
+from fractions import Fraction
+
+import answer_match
+
+# Serve these standards locally this often even when the model is healthy (0 = only as a fallback)
+LOCAL_MIX = float(os.environ.get("LOCAL_GENERATOR_MIX", "0"))
+
+_THEMES = {
+    "space": ("a rover", "km"),
+    "games": ("a player", "points"),
+    "sports": ("a runner", "meters"),
+}
+_OP_SYMBOLS = {"+": "+", "-": "-", "*": "\\times", "/": "\\div"}
+
+def _fmt_decimal(value, places=2):
+    text = f"{float(value):.{places}f}".rstrip("0").rstrip(".")
+    return "0" if text in ("-0", "") else text
+
+def _fmt_fraction(value):
+    value = Fraction(value)
+    if value.denominator == 1:
+        return str(value.numerator)
+    sign = "-" if value < 0 else ""
+    return f"{sign}\\frac{{{abs(value.numerator)}}}{{{value.denominator}}}"
+
+def _question(text, steps, correct, distractors):
+    """Assemble the generate_question dict; distractors is [(value, error_type, why), ...]."""
+    options, analysis, error_types = [f"${correct}$"], {}, {}
+    seen = {answer_match.canonical(options[0])}
+    for value, err_type, why in distractors:
+        opt = f"${value}$"
+        form = answer_match.canonical(opt)
+        if form in seen:
+            continue
+        seen.add(form)
+        options.append(opt)
+        analysis[opt] = why
+        error_types[opt] = err_type
+        if len(options) == 4:
+            break
+    return {
+        "question_text": text,
+        "solution_steps": steps,
+        "correct_answer": f"${correct}$",
+        "options": options,
+        "analysis": analysis,
+        "error_types": error_types,
+    }
+
+# --- TEMPLATES ---
+def decimal_operations(rng, scaffold):
+    """6.NS.B.3: add, subtract, multiply or divide multi-digit decimals."""
+    who, unit = rng.choice(list(_THEMES.values()))
+    op = rng.choice(("+", "-", "*") if scaffold else ("+", "-", "*", "/"))
+    places = 1 if scaffold else 2
+    a = Fraction(rng.randint(100, 999), 10 ** places)
+    b = Fraction(rng.randint(11, 99), 10)
+    if op == "+":
+        answer = a + b
+        text = f"{who.capitalize()} covers ${_fmt_decimal(a)}$ {unit}, then ${_fmt_decimal(b)}$ {unit} more. What is the total?"
+        distractors = [
+            (_fmt_decimal(a + b / 10), "ARITHMETIC", "Lined up the last digits instead of the decimal points."),
+            (_fmt_decimal(a - b), "CONCEPTUAL", "Subtracted instead of adding."),
+            (_fmt_decimal(a + b + 1), "ARITHMETIC", "Carried incorrectly across the decimal point."),
+        ]
+    elif op == "-":
+        a, b = max(a, b), min(a, b)
+        answer = a - b
+        text = f"{who.capitalize()} has ${_fmt_decimal(a)}$ {unit} and uses ${_fmt_decimal(b)}$ {unit}. How much is left?"
+        distractors = [
+            (_fmt_decimal(a - b / 10), "ARITHMETIC", "Lined up the last digits instead of the decimal points."),
+            (_fmt_decimal(a + b), "CONCEPTUAL", "Added instead of subtracting."),
+            (_fmt_decimal(a - b - 1), "ARITHMETIC", "Borrowed incorrectly."),
+        ]
+    elif op == "*":
+        b = Fraction(rng.randint(2, 9), 10)
+        answer = a * b
+        text = f"Each lap is ${_fmt_decimal(a)}$ {unit}. How far is ${_fmt_decimal(b)}$ of a lap?"
+        distractors = [
+            (_fmt_decimal(answer * 10, 4), "SKILL", "Counted too few decimal places in the product."),
+            (_fmt_decimal(answer / 10, 4), "SKILL", "Counted too many decimal places in the product."),
+            (_fmt_decimal(a + b), "CONCEPTUAL", "Added instead of multiplying."),
+        ]
+    else:
+        b = Fraction(rng.randint(2, 9), 10)
+        answer = Fraction(rng.randint(12, 99), 10)
+        a = answer * b
+        text = f"${_fmt_decimal(a)}$ {unit} are split into parts of ${_fmt_decimal(b)}$ {unit}. How many parts are there?"
+        distractors = [
+            (_fmt_decimal(answer / 10, 4), "SKILL", "Did not move the decimal point in both numbers."),
+            (_fmt_decimal(answer * 10, 4), "SKILL", "Moved the decimal point in the dividend only."),
+            (_fmt_decimal(a * b, 4), "CONCEPTUAL", "Multiplied instead of dividing."),
+        ]
+    symbol = _OP_SYMBOLS[op]
+    steps = f"${_fmt_decimal(a)} {symbol} {_fmt_decimal(b)} = {_fmt_decimal(answer, 4)}$"
+    return _question(text, steps, _fmt_decimal(answer, 4), distractors)
+
+def rational_addition(rng, scaffold):
+    """7.NS.A.1: add and subtract integers (and, off the scaffold, simple fractions)."""
+    who, unit = rng.choice(list(_THEMES.values()))
+    if scaffold or rng.random() < 0.6:
+        a, b = rng.randint(-30, 30), rng.randint(-30, -1)
+        answer = a + b
+        text = (f"The temperature on a moon base is ${a}^\\circ$C and then changes by ${b}^\\circ$C. "
+                f"What is the new temperature?")
+        steps = f"${a} + ({b}) = {answer}$"
+        distractors = [
+            (a - b, "ARITHMETIC", "Treated adding a negative as adding a positive."),
+            (-(a + b) if a + b else abs(a) + abs(b), "ARITHMETIC", "Got the sign of the result wrong."),
+            (abs(a) + abs(b) if abs(a) + abs(b) != answer else answer - 2, "CONCEPTUAL", "Ignored the signs and added the sizes."),
+            (answer + 1, "ARITHMETIC", "Miscounted on the number line."),
+        ]
+        return _question(text, steps, answer, distractors)
+    d1, d2 = rng.choice((2, 3, 4, 5, 6)), rng.choice((2, 3, 4, 8))
+    a = Fraction(rng.randint(-9, 9) or 1, d1)
+    b = Fraction(-rng.randint(1, 9), d2)
+    answer = a + b
+    text = f"{who.capitalize()} scores ${_fmt_fraction(a)}$ {unit}, then ${_fmt_fraction(b)}$ {unit}. What is the net change?"
+    steps = f"${_fmt_fraction(a)} + ({_fmt_fraction(b)}) = {_fmt_fraction(answer)}$"
+    wrong_denoms = Fraction(a.numerator + b.numerator, a.denominator + b.denominator)
+    distractors = [
+        (_fmt_fraction(wrong_denoms), "CONCEPTUAL", "Added numerators and denominators separately."),
+        (_fmt_fraction(a - b), "ARITHMETIC", "Treated adding a negative as adding a positive."),
+        (_fmt_fraction(-answer), "ARITHMETIC", "Got the sign of the result wrong."),
+        (_fmt_fraction(answer + 1), "ARITHMETIC", "Miscounted when combining."),
+    ]
+    return _question(text, steps, _fmt_fraction(answer), distractors)
+
+def integer_exponents(rng, scaffold):
+    """8.EE.A.1: apply the properties of integer exponents."""
+    base = rng.choice((2, 3, 5, 10))
+    m, n = rng.randint(2, 5), rng.randint(1, 4) * (1 if scaffold else rng.choice((1, -1)))
+    rule = rng.choice(("product", "quotient", "power"))
+    if rule == "product":
+        expr, exp = f"{base}^{{{m}}} \\cdot {base}^{{{n}}}", m + n
+        distractors = [
+            (f"{base}^{{{m * n}}}", "CONCEPTUAL", "Multiplied the exponents instead of adding them."),
+            (f"{base * base}^{{{m + n}}}", "CONCEPTUAL", "Multiplied the bases as well as combining exponents."),
+            (f"{base}^{{{m - n}}}", "SKILL", "Subtracted the exponents."),
+        ]
+    elif rule == "quotient":
+        expr, exp = f"\\frac{{{base}^{{{m}}}}}{{{base}^{{{n}}}}}", m - n
+        distractors = [
+            (f"{base}^{{{m + n}}}", "SKILL", "Added the exponents when dividing."),
+            (f"{base}^{{{n - m}}}", "ARITHMETIC", "Subtracted the exponents in the wrong order."),
+            (f"1^{{{m - n}}}", "CONCEPTUAL", "Divided the bases too."),
+        ]
+    else:
+        expr, exp = f"({base}^{{{m}}})^{{{n}}}", m * n
+        distractors = [
+            (f"{base}^{{{m + n}}}", "CONCEPTUAL", "Added the exponents instead of multiplying."),
+            (f"{base}^{{{m ** abs(n)}}}", "CONCEPTUAL", "Raised the exponent to a power."),
+            (f"{base * abs(n)}^{{{m}}}", "SKILL", "Multiplied the base by the outer exponent."),
+        ]
+    text = f"A power-up multiplies a score by ${expr}$. Write this as a single power of ${base}$."
+    steps = f"${expr} = {base}^{{{exp}}}$"
+    return _question(text, steps, f"{base}^{{{exp}}}", distractors)
+
+def numeric_exponents(rng, scaffold):
+    """6.EE.A.1: evaluate numerical expressions with whole-number exponents."""
+    base = rng.randint(2, 5 if scaffold else 9)
+    exp = rng.randint(2, 3)
+    c = rng.randint(1, 20)
+    answer = base ** exp + c
+    text = f"A game awards ${base}^{{{exp}}} + {c}$ bonus points. How many points is that?"
+    steps = f"${base}^{{{exp}}} + {c} = {base ** exp} + {c} = {answer}$"
+    distractors = [
+        (base * exp + c, "CONCEPTUAL", "Multiplied the base by the exponent."),
+        ((base + c) ** exp if (base + c) ** exp < 10 ** 6 else base ** (exp + 1) + c, "SKILL",
+         "Added before applying the exponent (order of operations)."),
+        (base ** (exp + 1) + c if exp == 2 else base ** (exp - 1) + c, "ARITHMETIC", "Multiplied the base one time too many or too few."),
+        (answer + base, "ARITHMETIC", "Made an arithmetic slip while evaluating."),
+    ]
+    return _question(text, steps, answer, distractors)
+
+TEMPLATES = {
+    "6.NS.B.3": decimal_operations,
+    "7.NS.A.1": rational_addition,
+    "8.EE.A.1": integer_exponents,
+    "6.EE.A.1": numeric_exponents,
+}
+
+def supports(standard_id):
+    return standard_id in TEMPLATES
+
+def generate_question(standard_id, description=None, error_context=None, rng=None):
+    """Local counterpart of ai_engine.generate_question for standards in TEMPLATES."""
+    rng = rng or random.Random()
+    template = TEMPLATES[standard_id]
+    # A few draws can collapse distractors onto the answer; redraw until there are four options
+    for _ in range(20):
+        q = template(rng, scaffold=bool(error_context))
+        if len(q['options']) == 4:
+            rng.shuffle(q['options'])
+            return q
+    raise RuntimeError(f"Template for {standard_id} could not produce four distinct options")
+
+def generate_questions(standard_id, description=None, n=1, error_context=None, rng=None):
+    rng = rng or random.Random()
+    return [generate_question(standard_id, description, error_context, rng) for _ in range(n)]
@@ -0,0 +1,210 @@
+"""Lightweight latency/token instrumentation with Prometheus text and JSONL trace export.
+
+Off unless METRICS_ENABLED=1; when off every hook returns immediately. When on:
+    - counters and histograms are written in Prometheus text format to METRICS_PROM_PATH
+      (point node_exporter's textfile collector or a sidecar at it)
+    - each script run becomes one JSON line in METRICS_TRACE_PATH with the spans
+      (model calls, parsing, ...) that happened during it
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+PROM_PATH = os.environ.get("METRICS_PROM_PATH", "metrics.prom")
+TRACE_PATH = os.environ.get("METRICS_TRACE_PATH", "traces.jsonl")
+FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "10"))
+PREFIX = "pathfinder_"
+
+# Seconds; covers cache hits (ms) through slow model calls (tens of seconds)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_gauges = {}      # (name, labels) -> latest value
+_trace_buffer = []
+_last_flush = time.monotonic()
+_local = threading.local()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    if not ENABLED or value is None:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    """Record the current value of a level such as a queue depth."""
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, seconds, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+        h[-2] += 1
+        h[-1] += seconds
+    span(name, seconds, **labels)
+
+def span(name, seconds, **fields):
+    """Attach a span to the trace of the script run on this thread, if one is open."""
+    run = getattr(_local, 'run', None)
+    if run is not None:
+        run['spans'].append({"name": name, "s": round(seconds, 6), **fields})
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            inc(self.name.replace("_seconds", "") + "_errors_total", error=exc_type.__name__, **self.labels)
+        return False
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP = _NoopTimer()
+
+def timer(name, **labels):
+    """Context manager recording wall time into histogram `name` (and error classes on exceptions)."""
+    return _Timer(name, labels) if ENABLED else _NOOP
+
+def timed(name, **labels):
+    """Decorator form of timer()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Timer(name, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# --- PER-INTERACTION TRACES ---
+def begin_run(kind, **fields):
+    """Open the trace for a Streamlit script run on this thread."""
+    if not ENABLED:
+        return
+    _local.run = {"ts": time.time(), "kind": kind, "start": time.perf_counter(), "spans": [], **fields}
+
+def in_run():
+    """True if a run's trace is open on this thread."""
+    return getattr(_local, 'run', None) is not None
+
+def end_run(outcome="complete"):
+    """Close this thread's run: record its duration and queue its JSONL trace line."""
+    if not ENABLED:
+        return
+    run = getattr(_local, 'run', None)
+    if run is None:
+        return
+    _local.run = None
+    duration = time.perf_counter() - run.pop('start')
+    observe("script_run_seconds", duration, kind=run['kind'], outcome=outcome)
+    inc("script_runs_total", kind=run['kind'], outcome=outcome)
+    run.update(duration_s=round(duration, 6), outcome=outcome)
+    with _lock:
+        _trace_buffer.append(json.dumps(run, default=str))
+    maybe_flush()
+
+# --- EXPORT ---
+def _fmt_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+def export_prometheus():
+    """Render all counters, gauges and histograms in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+    typed = set()
+    for (name, labels), value in gauges:
+        metric = PREFIX + name
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} gauge")
+            typed.add(metric)
+        lines.append(f"{metric}{_fmt_labels(labels)} {value}")
+    for (name, labels), value in counters:
+        metric = PREFIX + name
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} counter")
+            typed.add(metric)
+        lines.append(f"{metric}{_fmt_labels(labels)} {value}")
+    for (name, labels), h in histograms:
+        metric = PREFIX + name
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        for bound, count in zip(BUCKETS, h):
+            lines.append(f"{metric}_bucket{_fmt_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{metric}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {h[-2]}")
+        lines.append(f"{metric}_sum{_fmt_labels(labels)} {h[-1]}")
+        lines.append(f"{metric}_count{_fmt_labels(labels)} {h[-2]}")
+    return "\n".join(lines) + "\n"
+
+def flush():
+    """Write the Prometheus file and append buffered traces."""
+    global _last_flush
+    if not ENABLED:
+        return
+    with _lock:
+        traces = _trace_buffer[:]
+        _trace_buffer.clear()
+        _last_flush = time.monotonic()
+    if traces:
+        with open(TRACE_PATH, 'a') as f:
+            f.write("\n".join(traces) + "\n")
+    tmp = PROM_PATH + ".tmp"
+    with open(tmp, 'w') as f:
+        f.write(export_prometheus())
+    os.replace(tmp, PROM_PATH)
+
+def maybe_flush():
+    if ENABLED and time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+@contextmanager
+def enabled(prom_path=None, trace_path=None):
+    """Temporarily turn metrics on (benchmarks and ad-hoc profiling)."""
+    global ENABLED, PROM_PATH, TRACE_PATH
+    saved = ENABLED, PROM_PATH, TRACE_PATH
+    ENABLED, PROM_PATH, TRACE_PATH = True, prom_path or PROM_PATH, trace_path or TRACE_PATH
+    try:
+        yield
+    finally:
+        flush()
+        ENABLED, PROM_PATH, TRACE_PATH = saved
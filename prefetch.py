@@ -0,0 +1,164 @@
+"""Background prefetching so the next question is ready before the student asks for it.
+
+Besides the queues primed for the current standard, a wrong answer starts a speculative
+scaffolded fill for the gap it was routed to, so the "Fix" click finds a question waiting.
+"""
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import metrics
+import question_cache
+import scheduler
+
+# One worker pool for the whole process, shared by every student session
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "8"))
+# How many questions to keep queued for the standard the student is working on
+PREFETCH_DEPTH = int(os.environ.get("PREFETCH_DEPTH", "1"))
+# Longest a "Fix" click waits for a speculative fill that is already running
+SPECULATION_WAIT = float(os.environ.get("PREFETCH_SPECULATION_WAIT", "0.5"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    return _executor
+
+def is_usable(q):
+    """True if a generated question can be shown to a student (not an error placeholder)."""
+    return isinstance(q, dict) and "question_text" in q and q.get('correct_answer') not in (None, "Error")
+
+def _prefetch_question(standard_id, description, error_context, student_id):
+    # Prefetching is speculative, so it queues behind anything a student is waiting on.
+    # The question is only picked for the student here; take() marks it served when shown.
+    with scheduler.priority(scheduler.BACKGROUND):
+        return question_cache.get_cache().get_question(standard_id, description, error_context, student_id,
+                                                       claim=False)
+
+def _speculate(standard_id, description, error_context, student_id):
+    with scheduler.priority(scheduler.BACKGROUND):
+        question_cache.get_cache().prepare(standard_id, description, error_context, student_id)
+
+class Prefetcher:
+    """Per-session queues of questions being generated ahead of time, keyed by standard."""
+
+    def __init__(self, student_id=None, depth=PREFETCH_DEPTH):
+        self.student_id = student_id
+        self.depth = max(depth, 1)
+        self._queues = {}  # standard_id -> deque of (error_context, future)
+        self._speculation = None  # (origin standard, gap standard, error_context, future)
+        self._lock = threading.Lock()
+
+    def prime(self, node, curriculum, error_context=None):
+        """Top up the queue for `node` and for a scaffolded question on its top prerequisite.
+
+        `error_context` scaffolds the questions for `node` itself (set while fixing a gap).
+        """
+        targets = {node['id']: (node, error_context, self.depth)}
+        prereqs = node.get('prerequisites', {})
+        if prereqs:
+            # The first listed prerequisite is the most likely gap route
+            err_type, gap_id = next(iter(prereqs.items()))
+            if gap_id in curriculum and gap_id not in targets:
+                targets[gap_id] = (curriculum[gap_id], err_type, 1)
+
+        with self._lock:
+            # The student moved on: drop work for standards we no longer need
+            for std_id in list(self._queues):
+                if std_id not in targets:
+                    self._cancel(std_id)
+            spec = self._speculation
+            if spec is not None and node['id'] not in spec[:2]:
+                self._drop_speculation()
+
+            for std_id, (target, err_type, depth) in targets.items():
+                queue = self._queues.setdefault(std_id, deque())
+                if any(ctx != err_type for ctx, _ in queue):
+                    self._cancel(std_id)
+                    queue = self._queues[std_id] = deque()
+                while len(queue) < depth:
+                    queue.append((err_type, get_executor().submit(
+                        _prefetch_question, target['id'], target['description'], err_type, self.student_id
+                    )))
+
+    def speculate(self, origin_id, gap_node, error_context):
+        """After a wrong answer on `origin_id`, fill a scaffolded question for the diagnosed gap."""
+        key = (gap_node['id'], error_context)
+        with self._lock:
+            spec = self._speculation
+            if spec is not None:
+                if spec[1:3] == key:
+                    return
+                self._drop_speculation()
+            future = get_executor().submit(_speculate, gap_node['id'], gap_node['description'],
+                                           error_context, self.student_id)
+            self._speculation = (origin_id,) + key + (future,)
+        metrics.inc("speculation_total", outcome="started")
+
+    def take(self, std_id, error_context=None):
+        """Pop the next prefetched question for `std_id` if it is ready.
+
+        Returns None when nothing finished for this standard or the generation failed; the caller
+        then makes its own foreground request rather than wait behind other sessions' prefetches. A
+        matching speculative fill that is already running is waited on for up to SPECULATION_WAIT,
+        so the cache request that follows is likely a hit; one that hasn't started is cancelled.
+        """
+        with self._lock:
+            queue = self._queues.get(std_id)
+            entry = queue.popleft() if queue and queue[0][0] == error_context else None
+            spec = self._speculation
+            if spec is not None and spec[1:3] == (std_id, error_context):
+                self._speculation = None
+            else:
+                spec = None
+        if spec is not None:
+            if spec[3].cancel():
+                # Still queued behind other prefetches: the caller's foreground request is faster
+                metrics.inc("speculation_total", outcome="cancelled")
+            else:
+                # Already running: give it a moment to land in the pool, but never wait out a slow fill
+                try:
+                    spec[3].result(timeout=SPECULATION_WAIT)
+                    metrics.inc("speculation_total", outcome="used")
+                except TimeoutError:
+                    metrics.inc("speculation_total", outcome="late")
+                except Exception:
+                    metrics.inc("speculation_total", outcome="failed")
+        if entry is None:
+            return None
+        if not entry[1].done():
+            # Queued or still at background priority: drop it (a running one just finishes unused)
+            entry[1].cancel()
+            metrics.inc("prefetch_total", outcome="not_ready")
+            return None
+        metrics.inc("prefetch_total", outcome="ready")
+        try:
+            q = entry[1].result()
+        except Exception:
+            return None
+        if not is_usable(q):
+            return None
+        return question_cache.get_cache().mark_served(self.student_id, q)
+
+    def cancel_all(self):
+        with self._lock:
+            for std_id in list(self._queues):
+                self._cancel(std_id)
+            self._drop_speculation()
+
+    def _cancel(self, std_id):
+        # Futures already running can't be interrupted; their results are simply discarded
+        for _, future in self._queues.pop(std_id, ()):
+            future.cancel()
+
+    def _drop_speculation(self):
+        # A fill that already ran stays in the shared pool for whoever asks next
+        if self._speculation is not None:
+            cancelled = self._speculation[3].cancel()
+            metrics.inc("speculation_total", outcome="cancelled" if cancelled else "returned_to_pool")
+            self._speculation = None
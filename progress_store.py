@@ -0,0 +1,296 @@
+"""Student progress that outlives a Streamlit session: streaks, mastery, the current
+question, and an append-only log of every attempt.
+
+ProgressStore is the interface; SQLiteProgressStore implements it on one WAL-mode file
+that every replica on a host (or a shared volume) can open. A networked store only
+has to implement the same methods.
+
+Writes are debounced: streak, mastery and current-question updates are coalesced in
+memory (the latest value per key wins) and written in one transaction by a background
+thread every PROGRESS_FLUSH_INTERVAL seconds, or sooner once PROGRESS_FLUSH_BATCH
+changes are pending. Reads go through a small in-process cache.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+DB_PATH = os.environ.get("PROGRESS_DB_PATH", "progress.db")
+FLUSH_INTERVAL = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", "1.0"))
+FLUSH_BATCH = int(os.environ.get("PROGRESS_FLUSH_BATCH", "200"))
+# Cached reads are trusted this long; another replica's writes show up after at most this delay
+CACHE_TTL = float(os.environ.get("PROGRESS_CACHE_TTL", "30"))
+CACHE_SIZE = int(os.environ.get("PROGRESS_CACHE_SIZE", "5000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    student_id TEXT PRIMARY KEY,
+    current_std TEXT,
+    current_q TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS streaks (
+    student_id TEXT NOT NULL,
+    standard_id TEXT NOT NULL,
+    streak INTEGER NOT NULL,
+    PRIMARY KEY (student_id, standard_id)
+);
+CREATE TABLE IF NOT EXISTS mastered (
+    student_id TEXT NOT NULL,
+    standard_id TEXT NOT NULL,
+    mastered_at REAL NOT NULL,
+    PRIMARY KEY (student_id, standard_id)
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    student_id TEXT NOT NULL,
+    standard_id TEXT NOT NULL,
+    question_text TEXT,
+    answer TEXT,
+    correct_answer TEXT,
+    is_correct INTEGER NOT NULL,
+    error_type TEXT,
+    gap_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_student ON attempts(student_id);
+"""
+
+ATTEMPT_FIELDS = ("ts", "student_id", "standard_id", "question_text", "answer", "correct_answer",
+                  "is_correct", "error_type", "gap_id")
+
+def empty_progress():
+    return {"streaks": {}, "mastered": set(), "current_std": None, "current_q": None}
+
+class ProgressStore:
+    """Per-student progress. Every method is thread-safe and keyed by a stable student id."""
+
+    def load(self, student_id):
+        """{"streaks": {std: n}, "mastered": {std, ...}, "current_std": str|None, "current_q": dict|None}"""
+        raise NotImplementedError
+
+    def set_streak(self, student_id, standard_id, streak):
+        raise NotImplementedError
+
+    def add_mastered(self, student_id, standard_id):
+        raise NotImplementedError
+
+    def set_current(self, student_id, standard_id, question):
+        """Remember what the student is working on so another session can resume it."""
+        raise NotImplementedError
+
+    def record_attempt(self, student_id, standard_id, question_text, answer, correct_answer,
+                       is_correct, error_type=None, gap_id=None):
+        raise NotImplementedError
+
+    def attempts(self, student_id=None, since_id=0):
+        """Yield logged attempts (dicts with an "id" and ATTEMPT_FIELDS) in order."""
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+class SQLiteProgressStore(ProgressStore):
+    def __init__(self, path=DB_PATH, flush_interval=FLUSH_INTERVAL, flush_batch=FLUSH_BATCH,
+                 cache_ttl=CACHE_TTL, cache_size=CACHE_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._db = self._connect()
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        # One flush at a time, so an older batch can never land after a newer one
+        self._flush_lock = threading.Lock()
+        self._cache = OrderedDict()  # student_id -> (loaded_at, progress)
+        self._pending = {}           # (table, student_id, standard_id) -> row values
+        self._pending_attempts = []
+        self._wake = threading.Event()
+        self._closed = False
+        self.flushes = 0
+        self._flusher = threading.Thread(target=self._run_flusher, name="progress-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # --- READS ---
+    def load(self, student_id):
+        with self._lock:
+            cached = self._cache.get(student_id)
+            if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+                self._cache.move_to_end(student_id)
+                return _copy(cached[1])
+        progress = self._read(student_id)
+        with self._lock:
+            # Writes that haven't been flushed yet are newer than what the database returned
+            for (table, sid, std), row in self._pending.items():
+                if sid == student_id:
+                    _apply(progress, table, std, row)
+            self._remember(student_id, progress)
+            return _copy(progress)
+
+    def _read(self, student_id):
+        progress = empty_progress()
+        with self._db_lock:
+            row = self._db.execute("SELECT current_std, current_q FROM students WHERE student_id = ?",
+                                   (student_id,)).fetchone()
+            streaks = self._db.execute("SELECT standard_id, streak FROM streaks WHERE student_id = ?",
+                                       (student_id,)).fetchall()
+            mastered = self._db.execute("SELECT standard_id FROM mastered WHERE student_id = ?",
+                                        (student_id,)).fetchall()
+        if row is not None:
+            progress["current_std"] = row[0]
+            progress["current_q"] = json.loads(row[1]) if row[1] else None
+        progress["streaks"] = dict(streaks)
+        progress["mastered"] = {std for (std,) in mastered}
+        return progress
+
+    def attempts(self, student_id=None, since_id=0):
+        self.flush()
+        query = "SELECT id, " + ", ".join(ATTEMPT_FIELDS) + " FROM attempts WHERE id > ?"
+        params = [since_id]
+        if student_id is not None:
+            query += " AND student_id = ?"
+            params.append(student_id)
+        # A separate connection so a long scan doesn't hold up flushes
+        db = self._connect()
+        try:
+            for row in db.execute(query + " ORDER BY id", params):
+                yield dict(zip(("id",) + ATTEMPT_FIELDS, row))
+        finally:
+            db.close()
+
+    # --- WRITES (debounced) ---
+    def set_streak(self, student_id, standard_id, streak):
+        self._queue(("streaks", student_id, standard_id), {"streak": int(streak)})
+
+    def add_mastered(self, student_id, standard_id):
+        self._queue(("mastered", student_id, standard_id), {"mastered_at": time.time()})
+
+    def set_current(self, student_id, standard_id, question):
+        self._queue(("students", student_id, None), {"current_std": standard_id, "current_q": question})
+
+    def record_attempt(self, student_id, standard_id, question_text, answer, correct_answer,
+                       is_correct, error_type=None, gap_id=None):
+        row = (time.time(), student_id, standard_id, question_text, answer, correct_answer,
+               int(bool(is_correct)), error_type, gap_id)
+        with self._lock:
+            self._pending_attempts.append(row)
+            backlog = len(self._pending) + len(self._pending_attempts)
+        if backlog >= self.flush_batch:
+            self._wake.set()
+
+    def _queue(self, key, row):
+        with self._lock:
+            self._pending[key] = row
+            cached = self._cache.get(key[1])
+            if cached is not None:
+                _apply(cached[1], key[0], key[2], row)
+            backlog = len(self._pending) + len(self._pending_attempts)
+        if backlog >= self.flush_batch:
+            self._wake.set()
+
+    def flush(self):
+        """Write every pending change in one transaction."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                attempts, self._pending_attempts = self._pending_attempts, []
+            if not pending and not attempts:
+                return
+            try:
+                self._write(pending, attempts)
+            except sqlite3.Error:
+                # Put the changes back (behind anything newer) so the next flush retries them
+                with self._lock:
+                    for key, row in pending.items():
+                        self._pending.setdefault(key, row)
+                    self._pending_attempts[:0] = attempts
+                raise
+            self.flushes += 1
+
+    def _write(self, pending, attempts):
+        now = time.time()
+        with self._db_lock, self._db:
+            for (table, student_id, standard_id), row in pending.items():
+                if table == "streaks":
+                    self._db.execute(
+                        """INSERT INTO streaks VALUES (?, ?, ?)
+                           ON CONFLICT(student_id, standard_id) DO UPDATE SET streak = excluded.streak""",
+                        (student_id, standard_id, row["streak"]))
+                elif table == "mastered":
+                    self._db.execute("INSERT OR IGNORE INTO mastered VALUES (?, ?, ?)",
+                                     (student_id, standard_id, row["mastered_at"]))
+                else:
+                    q = row["current_q"]
+                    self._db.execute(
+                        """INSERT INTO students VALUES (?, ?, ?, ?) ON CONFLICT(student_id) DO UPDATE SET
+                           current_std = excluded.current_std, current_q = excluded.current_q,
+                           updated_at = excluded.updated_at""",
+                        (student_id, row["current_std"], json.dumps(q) if q else None, now))
+            self._db.executemany(
+                "INSERT INTO attempts (" + ", ".join(ATTEMPT_FIELDS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                attempts)
+
+    def _run_flusher(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                metrics.inc("progress_flush_errors_total", error=type(e).__name__)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    # --- CACHE ---
+    def _remember(self, student_id, progress):
+        self._cache[student_id] = (time.monotonic(), progress)
+        self._cache.move_to_end(student_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"cached_students": len(self._cache), "pending_writes": len(self._pending),
+                    "pending_attempts": len(self._pending_attempts), "flushes": self.flushes}
+
+def _apply(progress, table, standard_id, row):
+    if table == "streaks":
+        progress["streaks"][standard_id] = row["streak"]
+    elif table == "mastered":
+        progress["mastered"].add(standard_id)
+    else:
+        progress["current_std"] = row["current_std"]
+        progress["current_q"] = row["current_q"]
+
+def _copy(progress):
+    return {"streaks": dict(progress["streaks"]), "mastered": set(progress["mastered"]),
+            "current_std": progress["current_std"], "current_q": progress["current_q"]}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SQLiteProgressStore()
+    return _store
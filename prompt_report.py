@@ -0,0 +1,86 @@
+"""Per-call input tokens with everything inline versus the current prompt layout.
+
+"inline" is what one call would send with the instruction and schema in the prompt
+text (the layout before PROMPT_VERSION 3). "per_call" is what the current layout is
+billed for on every call: the request, the response schema, and the system instruction
+unless a context cache holds it. Instructions below LLM_CONTEXT_CACHE_MIN_TOKENS are
+never cached (see llm_backends.cacheable), so for them only the schema formatting and
+request wording change.
+
+Usage:
+    python prompt_report.py             # estimate (about 4 characters per token)
+    python prompt_report.py --count     # exact counts from the Gemini count_tokens API
+"""
+import argparse
+import json
+import sys
+
+import ai_engine
+import llm_backends
+
+SAMPLE = {
+    "standard_id": "7.RP.A.2",
+    "description": "Recognize and represent proportional relationships between quantities.",
+    "question_text": "A rover travels $12$ km in $3$ hours. How far does it travel in $5$ hours at the same rate?",
+    "wrong_answer": "$15$ km",
+}
+
+def sample_prompts():
+    """(call_type, per-call prompt) pairs for one representative request of each kind."""
+    request = ai_engine._question_request(SAMPLE["standard_id"], SAMPLE["description"], None)
+    return [
+        ("question", request),
+        ("question_batch", f"{request}\nWrite 4 DIFFERENT problems."),
+        ("diagnosis", f"Standard: {SAMPLE['standard_id']}\nQuestion: {SAMPLE['question_text']}\n"
+                      f"Student Answer: {SAMPLE['wrong_answer']}"),
+        ("hint", ai_engine._hint_prompt(SAMPLE["question_text"])),
+    ]
+
+def inline_prompt(call_type, prompt):
+    text = f"{ai_engine.SYSTEM_INSTRUCTIONS[call_type]}\n\n{prompt}"
+    schema = ai_engine.RESPONSE_SCHEMAS.get(call_type)
+    if schema is not None:
+        text += f"\n\nOUTPUT JSON FORMAT ONLY:\n{json.dumps(schema, indent=2)}"
+    return text
+
+def estimate_tokens(text):
+    return len(text) // 4
+
+def model_counter():
+    from llm_backends import models_from_env
+    client, models = ai_engine.get_client(), models_from_env()
+    return lambda call_type, text: client.models.count_tokens(model=models[call_type], contents=text).total_tokens
+
+def report(count=None):
+    count = count or (lambda call_type, text: estimate_tokens(text))
+    rows = []
+    for call_type, prompt in sample_prompts():
+        before = count(call_type, inline_prompt(call_type, prompt))
+        instruction = count(call_type, ai_engine.SYSTEM_INSTRUCTIONS[call_type])
+        request = count(call_type, prompt)
+        schema = ai_engine.RESPONSE_SCHEMAS.get(call_type)
+        # The response schema counts toward input tokens
+        schema_tokens = count(call_type, json.dumps(schema)) if schema is not None else 0
+        cache_live = llm_backends.cacheable(instruction)
+        after = request + schema_tokens + (0 if cache_live else instruction)
+        rows.append({
+            "call_type": call_type,
+            "inline_tokens": before,
+            "instruction_tokens": instruction,
+            "request_tokens": request,
+            "schema_tokens": schema_tokens,
+            "instruction_cached": cache_live,
+            "per_call_tokens": after,
+            "saved_pct": round(100 * (before - after) / before, 1) if before else 0.0,
+        })
+    return {"prompt_version": ai_engine.PROMPT_VERSION, "calls": rows}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare per-call input tokens before and after prompt compaction.")
+    parser.add_argument("--count", action="store_true", help="use the model's tokenizer (needs GEMINI_API_KEY)")
+    args = parser.parse_args(argv)
+    print(json.dumps(report(model_counter() if args.count else None), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
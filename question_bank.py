@@ -0,0 +1,87 @@
+"""Read-only access to the offline question bank written by build_bank.py.
+
+The bank is a JSONL file with one record per line plus a JSON index mapping each
+cache key to the (offset, length) of its records, so the file can be memory-mapped
+and single questions decoded on demand without loading the whole bank.
+"""
+import json
+import mmap
+import os
+import random
+import threading
+
+BANK_PATH = os.environ.get("QUESTION_BANK_PATH", "question_bank.jsonl")
+
+def index_path(bank_path):
+    return bank_path + ".idx"
+
+def build_index(bank_path):
+    """Scan the bank and return {cache_key: [[offset, length], ...]} for every complete record."""
+    keys = {}
+    offset = 0
+    with open(bank_path, 'rb') as f:
+        for line in f:
+            length = len(line)
+            if line.endswith(b"\n"):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if isinstance(record, dict) and 'key' in record:
+                    keys.setdefault(record['key'], []).append([offset, length])
+            offset += length
+    return keys
+
+def write_index(bank_path, keys):
+    tmp = index_path(bank_path) + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump({"keys": keys}, f, separators=(",", ":"))
+    os.replace(tmp, index_path(bank_path))
+
+class QuestionBank:
+    """Memory-mapped question bank; sampling decodes only the chosen record."""
+
+    def __init__(self, path=BANK_PATH):
+        self.path = path
+        with open(index_path(path)) as f:
+            self._keys = {k: [tuple(span) for span in spans] for k, spans in json.load(f)['keys'].items()}
+        self._file = open(path, 'rb')
+        # mmap refuses empty files; an empty bank simply has no keys
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._keys else None
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        return len(self._keys.get(key, ()))
+
+    def keys(self):
+        return list(self._keys)
+
+    def get(self, key, i):
+        offset, length = self._keys[key][i]
+        with self._lock:
+            raw = self._mm[offset:offset + length]
+        return json.loads(raw)['question']
+
+    def sample(self, key, exclude=()):
+        """Pick a random question for `key` whose position is not in `exclude`; returns (position, question)."""
+        choices = [i for i in range(self.count(key)) if i not in exclude]
+        if not choices:
+            return None, None
+        i = random.choice(choices)
+        return i, self.get(key, i)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+_bank = None
+_bank_lock = threading.Lock()
+
+def get_bank():
+    """The process-wide bank, or None if no bank has been built."""
+    global _bank
+    with _bank_lock:
+        if _bank is None and os.path.exists(BANK_PATH) and os.path.exists(index_path(BANK_PATH)):
+            _bank = QuestionBank(BANK_PATH)
+    return _bank
@@ -0,0 +1,393 @@
+"""Disk-backed pool of validated questions in front of ai_engine.generate_question."""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ai_engine
+import local_generator
+import metrics
+import question_bank
+import scheduler
+import singleflight
+
+CACHE_PATH = os.environ.get("QUESTION_CACHE_PATH", "question_cache.db")
+# Questions kept ready per (standard, bucket, prompt version) key
+POOL_TARGET = int(os.environ.get("QUESTION_POOL_TARGET", "8"))
+# A pool may grow past the target while students keep exhausting it, up to this size
+POOL_MAX = int(os.environ.get("QUESTION_POOL_MAX", "40"))
+# Refill once a student has this many unseen questions left in a pool
+LOW_WATER = int(os.environ.get("QUESTION_POOL_LOW_WATER", "2"))
+REFILL_BATCH = int(os.environ.get("QUESTION_REFILL_BATCH", "3"))
+# Questions generated by the single shared call when a burst of students all miss the same pool
+MISS_FILL_BATCH = int(os.environ.get("QUESTION_MISS_FILL_BATCH", "4"))
+MAX_QUESTIONS = int(os.environ.get("QUESTION_CACHE_MAX", "5000"))
+TTL_SECONDS = int(os.environ.get("QUESTION_CACHE_TTL", str(7 * 24 * 3600)))
+# Serve template standards locally on a miss once foreground model calls wait this long (p95) for admission
+LOCAL_SLOW_WAIT = float(os.environ.get("LOCAL_GENERATOR_SLOW_WAIT", "2"))
+# ... or once foreground model calls take this long (p95, counting calls still in flight) ...
+LOCAL_SLOW_CALL = float(os.environ.get("LOCAL_GENERATOR_SLOW_CALL", "15"))
+# ... or at least this share of them fail
+LOCAL_FAIL_RATE = float(os.environ.get("LOCAL_GENERATOR_FAIL_RATE", "0.5"))
+# ... measured over foreground calls made in this many seconds, plus those still queued or running
+LOCAL_SLOW_WINDOW = float(os.environ.get("LOCAL_GENERATOR_SLOW_WINDOW", "60"))
+# Key on a question picked with claim=False that says how to mark it served (see mark_served)
+SERVED_RECEIPT = "_served"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pools (
+    cache_key TEXT PRIMARY KEY,
+    standard_id TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache_key TEXT NOT NULL REFERENCES pools(cache_key) ON DELETE CASCADE,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questions_key ON questions(cache_key);
+CREATE TABLE IF NOT EXISTS bank_served (
+    student_id TEXT NOT NULL,
+    cache_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (student_id, cache_key, position)
+);
+CREATE TABLE IF NOT EXISTS served (
+    student_id TEXT NOT NULL,
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    PRIMARY KEY (student_id, question_id)
+);
+"""
+
+def difficulty_bucket(error_context):
+    """Normal questions share one pool; scaffolded ones are pooled per error type."""
+    if not error_context:
+        return "normal"
+    return f"scaffold:{str(error_context).strip().upper()}"
+
+def cache_key(standard_id, error_context=None, prompt_version=None):
+    return "|".join([standard_id, difficulty_bucket(error_context), prompt_version or ai_engine.PROMPT_VERSION])
+
+class _Batch:
+    """Questions from one shared fill, handed out one per waiting caller."""
+
+    def __init__(self, items):
+        self._items = list(items)
+        self._lock = threading.Lock()
+
+    def claim(self):
+        with self._lock:
+            return self._items.pop() if self._items else None
+
+class QuestionCache:
+    """SQLite-backed question pools with per-student sampling, TTL/LRU eviction and async refill."""
+
+    def __init__(self, path=CACHE_PATH, pool_target=POOL_TARGET, pool_max=POOL_MAX, low_water=LOW_WATER,
+                 max_questions=MAX_QUESTIONS, ttl=TTL_SECONDS):
+        self.pool_target = pool_target
+        self.pool_max = max(pool_max, pool_target)
+        self.low_water = low_water
+        self.max_questions = max_questions
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.local = 0
+        self._lock = threading.RLock()
+        self._refilling = set()
+        self._refill_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refill")
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+        self.evict()
+
+    # --- PUBLIC API ---
+    def get_question(self, standard_id, description, error_context=None, student_id=None, claim=True):
+        """Serve an unseen cached question, generating (and caching) one on a miss.
+
+        Standards with a local template skip the model when it is congested or failing.
+        With claim=False (prefetch) the question is picked for the student but not yet marked
+        as served; call mark_served() once it is actually shown.
+        """
+        templated = local_generator.supports(standard_id)
+        if templated and local_generator.LOCAL_MIX and random.random() < local_generator.LOCAL_MIX:
+            return self._local_question(standard_id, error_context, "mix")
+        key = cache_key(standard_id, error_context)
+        q = self.take(key, student_id, claim)
+        if q is None:
+            q = self.take_from_bank(key, student_id, claim)
+        if q is not None:
+            self._count_lookup("hit")
+        else:
+            self._count_lookup("miss")
+            if templated and self._model_congested():
+                return self._local_question(standard_id, error_context, "congested")
+            q = self._fill_and_take(key, standard_id, description, error_context, student_id, claim)
+            if not ai_engine.validate_question(q) and templated:
+                return self._local_question(standard_id, error_context, "model_failed")
+            if not ai_engine.validate_question(q):
+                # Generation failed or was shed under load: a repeat beats an error placeholder
+                q = self.fallback(standard_id, key) or q
+        self._maybe_refill(key, standard_id, description, error_context, student_id)
+        return q
+
+    def prepare(self, standard_id, description, error_context=None, student_id=None):
+        """Make sure an unseen question is waiting in this pool for the student, generating if needed.
+
+        Nothing is claimed, so an unused result simply stays in the pool for the next request.
+        """
+        key = cache_key(standard_id, error_context)
+        bank = question_bank.get_bank()
+        if bank is not None and bank.count(key) >= self.pool_target:
+            return
+        if local_generator.supports(standard_id) and self._model_congested():
+            # A miss is served from the template while the model is congested; don't add to its queue
+            return
+        if self._pool_levels(key, student_id)[1]:
+            return
+        self._shared_fill(key, standard_id, description, error_context)
+
+    def prewarm(self, standard_id, description, error_context=None):
+        """Start a background refill of this pool if it is below target (see analytics.prewarm)."""
+        self._maybe_refill(cache_key(standard_id, error_context), standard_id, description, error_context, None)
+
+    def mark_served(self, student_id, q):
+        """Record a question picked with claim=False as served and return it without its receipt."""
+        if not isinstance(q, dict) or SERVED_RECEIPT not in q:
+            return q
+        q = dict(q)
+        self._record_served(student_id, q.pop(SERVED_RECEIPT))
+        return q
+
+    def _claim(self, student_id, q, receipt, claim):
+        """Mark q served now, or (claim=False) attach the receipt mark_served() needs later."""
+        if not claim:
+            return dict(q, **{SERVED_RECEIPT: receipt})
+        self._record_served(student_id, receipt)
+        return q
+
+    def _record_served(self, student_id, receipt):
+        if receipt[0] == "bank":
+            self._mark_bank_served(student_id, receipt[1], receipt[2])
+        else:
+            self._mark_served(student_id, receipt[1])
+
+    def _fill_and_take(self, key, standard_id, description, error_context, student_id, claim=True):
+        """Miss path: concurrent misses on one key (at one priority) share a single batched fill, and each caller
+        claims a distinct question from it."""
+        batch = self._shared_fill(key, standard_id, description, error_context)
+        claimed = batch.claim()
+        if claimed is not None:
+            qid, q = claimed
+            return self._claim(student_id, q, ["q", qid], claim)
+        # More students than the batch had questions (or the batch failed)
+        q = self.take(key, student_id, claim)
+        if q is not None:
+            return q
+        q = ai_engine.generate_question(standard_id, description, error_context)
+        if ai_engine.validate_question(q):
+            qid = self.put(standard_id, error_context, q)
+            q = self._claim(student_id, q, ["q", qid], claim)
+        return q
+
+    def _local_question(self, standard_id, error_context, reason):
+        with self._lock:
+            self.local += 1
+        metrics.inc("local_questions_total", reason=reason)
+        return local_generator.generate_question(standard_id, error_context=error_context)
+
+    def _model_congested(self):
+        # Recent waits only: once templates take over, few foreground samples arrive to clear old ones
+        sched = scheduler.get_scheduler()
+        if sched.recent_wait(scheduler.FOREGROUND, LOCAL_SLOW_WINDOW) >= LOCAL_SLOW_WAIT:
+            return True
+        # A slow or failing provider admits calls promptly, so check how the calls themselves went
+        latency, failure_rate = sched.recent_calls(scheduler.FOREGROUND, LOCAL_SLOW_WINDOW)
+        return latency >= LOCAL_SLOW_CALL or failure_rate >= LOCAL_FAIL_RATE
+
+    def _shared_fill(self, key, standard_id, description, error_context):
+        """One batched fill per pool and priority class. A student's miss never joins a fill started
+        by a prefetch or refill thread, which would queue at background priority and be shed first."""
+        level = scheduler.current_priority(scheduler.FOREGROUND)
+        return singleflight.do(("fill", key, level), self._fill, standard_id, description, error_context)
+
+    def _fill(self, standard_id, description, error_context):
+        questions = ai_engine.generate_questions(standard_id, description, MISS_FILL_BATCH, error_context)
+        return _Batch([(self.put(standard_id, error_context, q), q) for q in questions])
+
+    def take(self, key, student_id=None, claim=True):
+        """Sample one question from the pool that this student has not been served yet."""
+        with self._lock:
+            row = self._db.execute(
+                """SELECT id, payload FROM questions WHERE cache_key = ?
+                   AND id NOT IN (SELECT question_id FROM served WHERE student_id = ?)
+                   ORDER BY RANDOM() LIMIT 1""",
+                (key, student_id or ""),
+            ).fetchone()
+            if row is None:
+                return None
+            self._touch(key)
+            return self._claim(student_id, json.loads(row[1]), ["q", row[0]], claim)
+
+    def fallback(self, standard_id, key):
+        """Any stored question for this standard, repeats allowed, preferring the requested key."""
+        with self._lock:
+            row = self._db.execute(
+                """SELECT q.payload FROM questions q JOIN pools p ON p.cache_key = q.cache_key
+                   WHERE p.standard_id = ? AND p.prompt_version = ?
+                   ORDER BY q.cache_key = ? DESC, RANDOM() LIMIT 1""",
+                (standard_id, ai_engine.PROMPT_VERSION, key),
+            ).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        bank = question_bank.get_bank()
+        if bank is not None and bank.count(key):
+            return bank.sample(key)[1]
+        return None
+
+    def take_from_bank(self, key, student_id=None, claim=True):
+        """Sample an unseen question from the offline bank (build_bank.py), if one was built."""
+        bank = question_bank.get_bank()
+        if bank is None or not bank.count(key):
+            return None
+        with self._lock:
+            seen = {row[0] for row in self._db.execute(
+                "SELECT position FROM bank_served WHERE student_id = ? AND cache_key = ?", (student_id or "", key))}
+            position, q = bank.sample(key, exclude=seen)
+        if q is None:
+            return None
+        return self._claim(student_id, q, ["bank", key, position], claim)
+
+    def put(self, standard_id, error_context, q):
+        """Add a validated question to its pool and return its row id."""
+        key = cache_key(standard_id, error_context)
+        with self._lock, self._db:
+            self._db.execute(
+                """INSERT INTO pools (cache_key, standard_id, bucket, prompt_version, last_access)
+                   VALUES (?, ?, ?, ?, ?) ON CONFLICT(cache_key) DO UPDATE SET last_access = excluded.last_access""",
+                (key, standard_id, difficulty_bucket(error_context), ai_engine.PROMPT_VERSION, time.time()),
+            )
+            cur = self._db.execute(
+                "INSERT INTO questions (cache_key, payload, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(q), time.time()),
+            )
+            # Keep each pool bounded by dropping its oldest questions
+            self._db.execute(
+                """DELETE FROM questions WHERE cache_key = ? AND id NOT IN
+                   (SELECT id FROM questions WHERE cache_key = ? ORDER BY id DESC LIMIT ?)""",
+                (key, key, self.pool_max),
+            )
+            return cur.lastrowid
+
+    def evict(self):
+        """Drop expired questions, then whole least-recently-used pools until under the size bound."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM questions WHERE created_at < ?", (time.time() - self.ttl,))
+            self._db.execute("DELETE FROM pools WHERE prompt_version != ?", (ai_engine.PROMPT_VERSION,))
+            total = self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+            while total > self.max_questions:
+                oldest = self._db.execute("SELECT cache_key FROM pools ORDER BY last_access LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                self._db.execute("DELETE FROM pools WHERE cache_key = ?", oldest)
+                total = self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            questions = self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+            pools = self._db.execute("SELECT COUNT(*) FROM pools").fetchone()[0]
+            hits, misses, local = self.hits, self.misses, self.local
+        lookups = hits + misses
+        return {
+            **singleflight.stats(),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "local": local,
+            "questions": questions,
+            "pools": pools,
+        }
+
+    # --- INTERNALS ---
+    def _count_lookup(self, outcome):
+        # Script threads and prefetch workers look up concurrently
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc("question_cache_lookups_total", outcome=outcome)
+
+    def _mark_bank_served(self, student_id, key, position):
+        if not student_id:
+            return
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO bank_served VALUES (?, ?, ?)", (student_id, key, position))
+
+    def _mark_served(self, student_id, question_id):
+        if not student_id or question_id is None:
+            return
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO served (student_id, question_id) VALUES (?, ?)",
+                             (student_id, question_id))
+
+    def _touch(self, key):
+        with self._lock, self._db:
+            self._db.execute("UPDATE pools SET last_access = ? WHERE cache_key = ?", (time.time(), key))
+
+    def _pool_levels(self, key, student_id):
+        with self._lock:
+            size, unseen = self._db.execute(
+                """SELECT COUNT(*), COALESCE(SUM(id NOT IN (SELECT question_id FROM served WHERE student_id = ?)), 0)
+                   FROM questions WHERE cache_key = ?""",
+                (student_id or "", key),
+            ).fetchone()
+        return size, unseen
+
+    def _maybe_refill(self, key, standard_id, description, error_context, student_id):
+        bank = question_bank.get_bank()
+        if bank is not None and bank.count(key) >= self.pool_target:
+            # The offline bank already covers this key; don't spend model calls on it
+            return
+        if local_generator.supports(standard_id) and self._model_congested():
+            # Templates cover this standard until the model catches up
+            return
+        size, unseen = self._pool_levels(key, student_id)
+        if size >= self.pool_max or (size >= self.pool_target and unseen > self.low_water):
+            return
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+        self._refill_pool.submit(self._refill, key, standard_id, description, error_context)
+
+    def _refill(self, key, standard_id, description, error_context):
+        try:
+            # One batched model call fills the pool; it yields to calls students are waiting on
+            with scheduler.priority(scheduler.BACKGROUND):
+                questions = ai_engine.generate_questions(standard_id, description, REFILL_BATCH, error_context)
+            for q in questions:
+                self.put(standard_id, error_context, q)
+            self.evict()
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QuestionCache()
+    return _cache
+
+def get_question(standard_id, description, error_context=None, student_id=None):
+    return get_cache().get_question(standard_id, description, error_context, student_id)
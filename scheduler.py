@@ -0,0 +1,266 @@
+"""Shared admission control for model calls: token-bucket rate limiting, priority
+classes, retries with jittered exponential backoff and load shedding.
+
+Priorities (lower runs first):
+    INTERACTIVE - hints and diagnoses a student is waiting on
+    FOREGROUND  - a question the student asked for
+    BACKGROUND  - prefetch and cache refill
+
+Configure with LLM_RATE_PER_MIN (sized to the provider quota), LLM_BURST,
+LLM_MAX_QUEUE, LLM_MAX_RETRIES and LLM_QUEUE_TIMEOUT. Admission waits, queue depth, sheds
+and retries are exported through metrics (llm_admission_wait_seconds, llm_queue_depth,
+llm_shed_total, llm_retries_total).
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+INTERACTIVE, FOREGROUND, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", FOREGROUND: "foreground", BACKGROUND: "background"}
+
+RATE_PER_MIN = float(os.environ.get("LLM_RATE_PER_MIN", "900"))
+BURST = int(os.environ.get("LLM_BURST", "20"))
+MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "200"))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+# Longest a call may wait for admission before it is shed (background work gives up sooner)
+QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "20"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+class Overloaded(Exception):
+    """The call was shed: the queue is full or admission took too long."""
+
+def is_retryable(error):
+    """Rate limiting (429) and server errors (5xx) are worth retrying; anything else is not."""
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        return False
+    return code == 429 or 500 <= code < 600
+
+class TokenBucket:
+    def __init__(self, rate_per_s, capacity):
+        self.rate = rate_per_s
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        """Take a token if one is available; otherwise return seconds until the next one."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 1.0
+
+class _Ticket:
+    def __init__(self, priority):
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.shed = False
+
+class Scheduler:
+    """Admits calls in priority order at the bucket's rate. Thread-safe."""
+
+    def __init__(self, rate_per_min=RATE_PER_MIN, burst=BURST, max_queue=MAX_QUEUE,
+                 max_retries=MAX_RETRIES, queue_timeout=QUEUE_TIMEOUT):
+        self.bucket = TokenBucket(rate_per_min / 60.0, burst)
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._waits = {p: deque(maxlen=500) for p in PRIORITY_NAMES}  # (admitted at, seconds waited)
+        self._calls = {p: deque(maxlen=500) for p in PRIORITY_NAMES}  # (finished at, seconds, failed)
+        self._running = {p: {} for p in PRIORITY_NAMES}               # seq -> started at
+        self.admitted = {p: 0 for p in PRIORITY_NAMES}
+        self.shed = {p: 0 for p in PRIORITY_NAMES}
+        self.retries = 0
+
+    def admit(self, priority):
+        """Block until this call may go out. Raises Overloaded if it is shed."""
+        ticket = _Ticket(priority)
+        timeout = self.queue_timeout / 2 if priority == BACKGROUND else self.queue_timeout
+        deadline = ticket.enqueued + timeout
+        with self._cond:
+            if len(self._heap) >= self.max_queue and not self._shed_lower_than(priority):
+                self._count_shed(priority, "queue_full")
+                raise Overloaded(f"{PRIORITY_NAMES[priority]} call shed: queue full")
+            entry = (priority, next(self._seq), ticket)
+            heapq.heappush(self._heap, entry)
+            self._export_depth()
+            try:
+                while True:
+                    if ticket.shed:
+                        raise Overloaded(f"{PRIORITY_NAMES[priority]} call shed for higher-priority work")
+                    if self._heap[0][2] is ticket:
+                        delay = self.bucket.try_take()
+                        if delay == 0:
+                            heapq.heappop(self._heap)
+                            break
+                    else:
+                        delay = 0.05
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._count_shed(priority, "timeout")
+                        raise Overloaded(f"{PRIORITY_NAMES[priority]} call waited more than {timeout:.0f}s")
+                    self._cond.wait(min(delay, remaining))
+            except Overloaded:
+                if entry in self._heap:
+                    self._heap.remove(entry)
+                    heapq.heapify(self._heap)
+                raise
+            finally:
+                self._export_depth()
+                self._cond.notify_all()
+            self.admitted[priority] += 1
+            now = time.monotonic()
+            self._waits[priority].append((now, now - ticket.enqueued))
+        metrics.observe("llm_admission_wait_seconds", now - ticket.enqueued, priority=PRIORITY_NAMES[priority])
+
+    def _shed_lower_than(self, priority):
+        """Make room by dropping the newest queued call of a lower priority. Caller holds the lock."""
+        victims = [e for e in self._heap if e[0] > priority and not e[2].shed]
+        if not victims:
+            return False
+        victim = max(victims)
+        victim[2].shed = True
+        self._count_shed(victim[0], "preempted")
+        self._heap.remove(victim)
+        heapq.heapify(self._heap)
+        self._cond.notify_all()
+        return True
+
+    def _count_shed(self, priority, reason):
+        # Caller holds the lock
+        self.shed[priority] += 1
+        metrics.inc("llm_shed_total", priority=PRIORITY_NAMES[priority], reason=reason)
+
+    def _export_depth(self):
+        # Caller holds the lock
+        if not metrics.ENABLED:
+            return
+        depth = {p: 0 for p in PRIORITY_NAMES}
+        for p, _, _ in self._heap:
+            depth[p] += 1
+        for p, n in depth.items():
+            metrics.set_gauge("llm_queue_depth", n, priority=PRIORITY_NAMES[p])
+
+    def call(self, fn, priority=FOREGROUND):
+        """Run fn() once admitted, retrying 429/5xx failures with full-jitter exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            self.admit(priority)
+            seq, started = self._call_started(priority)
+            try:
+                result = fn()
+            except Exception as e:
+                self._call_finished(priority, seq, started, failed=True)
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                with self._cond:
+                    self.retries += 1
+                metrics.inc("llm_retries_total", priority=PRIORITY_NAMES[priority])
+                time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+            else:
+                self._call_finished(priority, seq, started, failed=False)
+                return result
+
+    def _call_started(self, priority):
+        with self._cond:
+            seq, started = next(self._seq), time.monotonic()
+            self._running[priority][seq] = started
+        return seq, started
+
+    def _call_finished(self, priority, seq, started, failed):
+        with self._cond:
+            self._running[priority].pop(seq, None)
+            now = time.monotonic()
+            self._calls[priority].append((now, now - started, failed))
+
+    def recent_calls(self, priority, window=60.0):
+        """(p95 call latency, failure rate) over the last `window` seconds, counting calls still
+        in flight at their time so far, so a provider that hangs shows up before its calls time out."""
+        now = time.monotonic()
+        with self._cond:
+            recent = [(s, failed) for t, s, failed in self._calls[priority] if now - t <= window]
+            recent += [(now - started, False) for started in self._running[priority].values()]
+        if not recent:
+            return 0.0, 0.0
+        ordered = sorted(s for s, _ in recent)
+        failures = sum(1 for _, failed in recent if failed)
+        return ordered[int(0.95 * (len(ordered) - 1))], failures / len(recent)
+
+    def recent_wait(self, priority, window=60.0):
+        """p95 admission wait over the last `window` seconds, counting queued calls at their wait so far."""
+        now = time.monotonic()
+        with self._cond:
+            samples = [w for t, w in self._waits[priority] if now - t <= window]
+            samples += [now - e[2].enqueued for e in self._heap if e[0] == priority]
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def stats(self):
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for p, _, _ in self._heap:
+                depth[PRIORITY_NAMES[p]] += 1
+            waits = {}
+            for p, samples in self._waits.items():
+                ordered = sorted(w for _, w in samples)
+                waits[PRIORITY_NAMES[p]] = {
+                    "mean_s": round(sum(ordered) / len(ordered), 4) if ordered else 0.0,
+                    "p95_s": round(ordered[int(0.95 * (len(ordered) - 1))], 4) if ordered else 0.0,
+                }
+            return {
+                "queue_depth": depth,
+                "wait": waits,
+                "admitted": {PRIORITY_NAMES[p]: n for p, n in self.admitted.items()},
+                "shed": {PRIORITY_NAMES[p]: n for p, n in self.shed.items()},
+                "retries": self.retries,
+            }
+
+# --- PRIORITY CONTEXT ---
+# Background workers mark their thread so ai_engine calls made there queue behind student traffic
+_local = threading.local()
+
+@contextmanager
+def priority(level):
+    previous = getattr(_local, 'priority', None)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+def current_priority(default):
+    level = getattr(_local, 'priority', None)
+    return default if level is None else level
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+    return _scheduler
+
+def stats():
+    return get_scheduler().stats()
@@ -0,0 +1,67 @@
+"""Process-wide request coalescing ("single flight") for identical in-flight calls.
+
+When several threads (Streamlit script threads, prefetch workers) make the same
+request at the same time, only the first one runs it; the others wait and receive
+the same result or exception.
+"""
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key. Thread-safe."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a call with the same key is in flight; then share its outcome."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+# Shared by ai_engine and question_cache so every coalesced call is counted in one place
+_group = SingleFlight()
+
+def do(key, fn, *args, **kwargs):
+    return _group.do(key, fn, *args, **kwargs)
+
+def stats():
+    return _group.stats()
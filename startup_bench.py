@@ -0,0 +1,117 @@
+"""Cold-start benchmark: module import times and time to first paint of the HOME screen.
+
+Every measurement runs in a fresh interpreter, so nothing is already imported or cached.
+"first paint" is the wall time from spawning the process until AppTest has finished the
+first script run of app.py (the HOME screen), including interpreter and Streamlit startup.
+
+Usage:
+    python startup_bench.py --repeat 5
+    python startup_bench.py --save benchmarks/startup.json
+    python startup_bench.py --compare benchmarks/startup.json   # exit 1 on regression
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = ("streamlit", "ai_engine", "question_cache", "answer_match", "google.genai")
+REGRESSION_TOLERANCE = 0.20
+
+_IMPORT_CHILD = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+_PAINT_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=60)
+at.run()
+if at.exception:
+    sys.exit(at.exception[0].message)
+print(json.dumps({"script_s": time.perf_counter() - start, "sdk_loaded": "google.genai" in sys.modules}))
+"""
+
+def child_env(warmup):
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    env = dict(os.environ)
+    env.update({
+        "WARMUP_ENABLED": "1" if warmup else "0",
+        "QUESTION_CACHE_PATH": os.path.join(workdir, "question_cache.db"),
+        "PROGRESS_DB_PATH": os.path.join(workdir, "progress.db"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    return env
+
+def run_child(code, env):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, out.stdout.strip().splitlines()[-1]
+
+def import_times(repeat, env):
+    times = {}
+    for module in MODULES:
+        samples = [float(run_child(_IMPORT_CHILD.format(module=module), env)[1]) for _ in range(repeat)]
+        times[module] = round(statistics.median(samples) * 1000, 1)
+    return times
+
+def first_paint(repeat, env):
+    walls, scripts, sdk_loaded = [], [], False
+    for _ in range(repeat):
+        wall, line = run_child(_PAINT_CHILD, env)
+        result = json.loads(line)
+        walls.append(wall)
+        scripts.append(result["script_s"])
+        sdk_loaded = sdk_loaded or result["sdk_loaded"]
+    return {
+        "first_paint_ms": round(statistics.median(walls) * 1000, 1),
+        "first_script_run_ms": round(statistics.median(scripts) * 1000, 1),
+        # Should stay False without warm-up: HOME must not pull in the model SDK
+        "sdk_loaded_before_paint": sdk_loaded,
+    }
+
+def compare(result, baseline):
+    problems = []
+    pairs = [("first_paint_ms", result["first_paint_ms"], baseline.get("first_paint_ms"))]
+    pairs += [(f"import_ms.{m}", v, baseline.get("import_ms", {}).get(m)) for m, v in result["import_ms"].items()]
+    for name, now, before in pairs:
+        if before and now > before * (1 + REGRESSION_TOLERANCE):
+            problems.append(f"{name}: {before} -> {now}")
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time and time to first paint in fresh processes.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", action="store_true", help="leave the background warm-up on")
+    parser.add_argument("--save", help="write the results JSON here")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    args = parser.parse_args(argv)
+
+    env = child_env(args.warmup)
+    result = {"repeat": args.repeat, "warmup": args.warmup, "import_ms": import_times(args.repeat, env)}
+    result.update(first_paint(args.repeat, env))
+    print(json.dumps(result, indent=2))
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(result, json.load(f))
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
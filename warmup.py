@@ -0,0 +1,45 @@
+"""Background warm-up for a fresh server process.
+
+The HOME screen needs no AI, so nothing heavy is loaded before it renders. Right after
+startup this loads, off the script thread, what the first practice page will need:
+the curriculum index, the question bank and cache, and the model client with an open
+connection. Disable with WARMUP_ENABLED=0.
+"""
+import os
+import threading
+import time
+
+import metrics
+
+ENABLED = os.environ.get("WARMUP_ENABLED", "1") == "1"
+
+def _steps():
+    import ai_engine
+    import curriculum_index
+    import question_bank
+    import question_cache
+    return (
+        ("curriculum_index", curriculum_index.load_index),
+        ("question_bank", question_bank.get_bank),
+        ("question_cache", question_cache.get_cache),
+        ("model_client", ai_engine.warm_up),
+    )
+
+def run():
+    """Run every warm-up step, returning {step: seconds}. A failing step is skipped, not fatal."""
+    timings = {}
+    for name, step in _steps():
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            metrics.inc("warmup_errors_total", step=name, error=type(e).__name__)
+        timings[name] = time.perf_counter() - start
+        metrics.observe("warmup_seconds", timings[name], step=name)
+    return timings
+
+def start():
+    """Start run() on a daemon thread and return the thread."""
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread